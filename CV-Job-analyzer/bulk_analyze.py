@@ -0,0 +1,270 @@
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.cache import get_default_cache
+from base.embeddings import embed_documents
+from base.router import POLICIES, build_default_router
+from cv_ingest import get_cv_ingestor
+from cv_job_analyze_with_Flask import CvJobDescriptionAnalyzer
+
+
+def load_job_descriptions(jobs_dir):
+    # One job description per .txt file, named after the file
+    return [
+        (path.stem, path.read_text(encoding="utf-8", errors="replace"))
+        for path in sorted(Path(jobs_dir).glob("*.txt"))
+    ]
+
+
+def load_cvs(cvs_dir, cv_ingestor):
+    cvs = []
+    for path in sorted(Path(cvs_dir).glob("*.pdf")):
+        try:
+            cvs.append((path.stem, cv_ingestor.get_text(path)))
+        except Exception as e:
+            print(f"Skipping {path.name}: {e}")
+    return cvs
+
+
+def get_top_k_pairs(job_vectors, cv_vectors, top_k):
+    # Cosine similarities of every (job, CV) pair, the top_k CVs of every job are kept
+    top_k = min(top_k, len(cv_vectors))
+    if faiss is not None:
+        index = faiss.IndexFlatIP(cv_vectors.shape[1])
+        index.add(cv_vectors)
+        similarities, cv_indices = index.search(job_vectors, top_k)
+        return similarities, cv_indices
+    similarity_matrix = job_vectors @ cv_vectors.T
+    cv_indices = np.argsort(-similarity_matrix, axis=1)[:, :top_k]
+    similarities = np.take_along_axis(similarity_matrix, cv_indices, axis=1)
+    return similarities, cv_indices
+
+
+def save_similarity_matrix(output_path, jobs, cvs, job_vectors, cv_vectors):
+    similarity_matrix = job_vectors @ cv_vectors.T
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["job"] + [cv_name for cv_name, _ in cvs])
+        for (job_name, _), row in zip(jobs, similarity_matrix):
+            writer.writerow([job_name] + [f"{value:.4f}" for value in row])
+
+
+async def analyze_pairs(cv_job_analyzer, pairs, structured=False):
+    if structured:
+        # The job sections are requested once per job before the pairs, otherwise the
+        # top_k CVs of a job would all miss the job cache at the same time
+        job_descs = list(dict.fromkeys(pair["job_desc"] for pair in pairs))
+        await asyncio.gather(
+            *[cv_job_analyzer.aget_job_sections(job_desc) for job_desc in job_descs],
+            return_exceptions=True,
+        )
+
+    # Every shortlisted pair is analyzed concurrently, within the concurrency limit of
+    # the analyzer
+    async def analyze_pair(pair):
+        job_desc, cv_content = pair.pop("job_desc"), pair.pop("cv_content")
+        try:
+            if structured:
+                pair["sections"] = await cv_job_analyzer.aanalyze_structured(
+                    job_desc, cv_content
+                )
+            else:
+                pair["analysis"] = await cv_job_analyzer.aanalyze(job_desc, cv_content)
+        except Exception as e:
+            pair["error"] = f"{type(e).__name__}: {e}"
+        return pair
+
+    return await asyncio.gather(*[analyze_pair(pair) for pair in pairs])
+
+
+def run_bulk_analysis(
+    cvs_dir,
+    jobs_dir,
+    output_dir,
+    top_k=5,
+    model_name="gpt-4o-mini",
+    api_key=None,
+    cache=None,
+    max_concurrency=8,
+    save_matrix=False,
+    structured=False,
+    routing_policy=None,
+):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = load_job_descriptions(jobs_dir)
+    cvs = load_cvs(cvs_dir, get_cv_ingestor())
+    if not jobs or not cvs:
+        print(f"Found {len(jobs)} job descriptions and {len(cvs)} CVs, nothing to do")
+        return
+    print(f"Screening {len(cvs)} CVs against {len(jobs)} job descriptions")
+
+    start = time.time()
+    job_vectors = embed_documents([text for _, text in jobs])
+    cv_vectors = embed_documents([text for _, text in cvs])
+    similarities, cv_indices = get_top_k_pairs(job_vectors, cv_vectors, top_k)
+    print(f"Embedded and ranked every pair in {time.time() - start:.1f}s")
+    if save_matrix:
+        save_similarity_matrix(
+            output_dir / "similarity_matrix.csv", jobs, cvs, job_vectors, cv_vectors
+        )
+
+    pairs = []
+    for (job_name, job_desc), job_similarities, job_cv_indices in zip(
+        jobs, similarities, cv_indices
+    ):
+        for rank, (similarity, cv_idx) in enumerate(
+            zip(job_similarities, job_cv_indices), start=1
+        ):
+            cv_name, cv_content = cvs[cv_idx]
+            pairs.append(
+                {
+                    "job": job_name,
+                    "cv": cv_name,
+                    "rank": rank,
+                    "similarity": round(float(similarity), 4),
+                    "job_desc": job_desc,
+                    "cv_content": cv_content,
+                }
+            )
+    print(
+        f"Analyzing the top {top_k} CVs of every job: {len(pairs)} LLM calls "
+        f"instead of {len(jobs) * len(cvs)}"
+    )
+
+    start = time.time()
+    cv_job_analyzer = CvJobDescriptionAnalyzer(
+        model_name,
+        api_key,
+        cache=cache,
+        max_concurrency=max_concurrency,
+        router=build_default_router(routing_policy) if routing_policy else None,
+    )
+    results = asyncio.run(analyze_pairs(cv_job_analyzer, pairs, structured))
+    print(f"Analyzed {len(results)} pairs in {time.time() - start:.1f}s")
+
+    with open(output_dir / "analyses.jsonl", "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    for job_name, _ in jobs:
+        shortlist = [r for r in results if r["job"] == job_name]
+        print(
+            f"{job_name}: "
+            + ", ".join(f"{r['cv']} ({r['similarity']:.2f})" for r in shortlist)
+        )
+    print(f"Analyses saved to {output_dir / 'analyses.jsonl'}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Screen many CVs against many job descriptions, only the best matches of every job are analyzed by the model"
+    )
+    parser.add_argument("cvs_dir", type=str, help="Folder of the CVs in PDF")
+    parser.add_argument(
+        "jobs_dir",
+        type=str,
+        help="Folder of the job descriptions, one .txt file per job",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="bulk_analysis",
+        help="Folder where the analyses are saved, default is bulk_analysis",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=5,
+        help="Number of best matching CVs analyzed by the model for every job, default is 5",
+    )
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default="gpt-4o-mini",
+        help="Model name for text generation, currently support OpenAI GPT and open-source Ollama (need to use 'ollama' api key) models, default is gpt-4o-mini",
+    )
+    parser.add_argument(
+        "--api_key",
+        type=str,
+        default=None,
+        help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=8,
+        help="Number of analyses requested from the model at the same time, default is 8",
+    )
+    parser.add_argument(
+        "--save_matrix",
+        action="store_true",
+        help="Also save the similarity of every (job, CV) pair to similarity_matrix.csv",
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="Save the analyses as JSON sections, with locally computed keyword matching and alignment score",
+    )
+    parser.add_argument(
+        "--routing_policy",
+        type=str,
+        choices=POLICIES,
+        default=None,
+        help="Route every request between the OpenAI and Ollama backends with this policy, model_name can then be 'auto', default is None to only use the backend of model_name",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main(
+    cvs_dir,
+    jobs_dir,
+    output_dir,
+    top_k,
+    model_name,
+    api_key,
+    max_concurrency=8,
+    save_matrix=False,
+    use_cache=False,
+    structured=False,
+    routing_policy=None,
+):
+    run_bulk_analysis(
+        cvs_dir,
+        jobs_dir,
+        output_dir,
+        top_k=top_k,
+        model_name=model_name,
+        api_key=api_key,
+        cache=get_default_cache() if use_cache else None,
+        max_concurrency=max_concurrency,
+        save_matrix=save_matrix,
+        structured=structured,
+        routing_policy=routing_policy,
+    )
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(**vars(args))
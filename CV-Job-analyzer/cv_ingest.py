@@ -0,0 +1,130 @@
+import io
+import re
+import sys
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.cache import DEFAULT_CACHE_DIR, MemoryCache, ResponseCache, SQLiteCache
+
+MAX_CV_BYTES = 10 * 1024 * 1024
+MAX_CV_PAGES = 50
+# Documents with at least this many pages are split across worker processes, below
+# that starting the workers costs more than it saves
+PARALLEL_MIN_PAGES = 8
+PAGES_PER_TASK = 4
+
+SPACES_RE = re.compile(r"[ \t\xa0]+")
+BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def read_cv_bytes(cv_file):
+    # Flask uploads and open files have read(), Gradio gives a path (or a tempfile
+    # wrapper with a name)
+    if hasattr(cv_file, "read"):
+        return cv_file.read()
+    return Path(getattr(cv_file, "name", cv_file)).read_bytes()
+
+
+def normalize_text(text):
+    lines = [SPACES_RE.sub(" ", line).strip() for line in text.splitlines()]
+    return BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def extract_pages(pdf_bytes, start, end):
+    # Top-level so that worker processes can run it, each one parses its own reader
+    pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+    return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+class CvIngestor:
+    # Extracted CV text keyed by the hash of the uploaded bytes, so the same CV run
+    # against many job descriptions is only parsed once
+    def __init__(
+        self,
+        cache=None,
+        max_bytes=MAX_CV_BYTES,
+        max_pages=MAX_CV_PAGES,
+        parallel_min_pages=PARALLEL_MIN_PAGES,
+        max_workers=None,
+    ):
+        if cache is None:
+            cache = ResponseCache(
+                MemoryCache(max_size=256),
+                SQLiteCache(path=DEFAULT_CACHE_DIR / "cv_texts.sqlite3", ttl=None),
+            )
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.parallel_min_pages = parallel_min_pages
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def get_text(self, cv_file):
+        pdf_bytes = read_cv_bytes(cv_file)
+        if len(pdf_bytes) > self.max_bytes:
+            raise ValueError(
+                f"The CV is {len(pdf_bytes) / 1024 / 1024:.1f} MB, "
+                f"the limit is {self.max_bytes / 1024 / 1024:.0f} MB"
+            )
+        cv_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        cv_content = self.cache.get(cv_hash)
+        if cv_content is not None:
+            print(f"CV {cv_hash[:12]} already extracted")
+            return cv_content
+
+        cv_content = normalize_text("\n".join(self.extract(pdf_bytes)))
+        self.cache.set(cv_hash, cv_content)
+        return cv_content
+
+    def extract(self, pdf_bytes):
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        n_pages = len(pdf_reader.pages)
+        if n_pages > self.max_pages:
+            raise ValueError(
+                f"The CV has {n_pages} pages, the limit is {self.max_pages} pages"
+            )
+        if n_pages < self.parallel_min_pages:
+            return [page.extract_text() or "" for page in pdf_reader.pages]
+        ranges = [
+            (start, min(start + PAGES_PER_TASK, n_pages))
+            for start in range(0, n_pages, PAGES_PER_TASK)
+        ]
+        futures = [
+            self.get_executor().submit(extract_pages, pdf_bytes, start, end)
+            for start, end in ranges
+        ]
+        # Pages are joined in document order, whatever order the workers finish in
+        return [page for future in futures for page in future.result()]
+
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawned, not forked: the app is already running threads (Flask
+                # requests, model warm-up) whose locks a forked child would inherit
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+
+_cv_ingestor = None
+_cv_ingestor_lock = threading.Lock()
+
+
+def get_cv_ingestor():
+    global _cv_ingestor
+    with _cv_ingestor_lock:
+        if _cv_ingestor is None:
+            _cv_ingestor = CvIngestor()
+    return _cv_ingestor
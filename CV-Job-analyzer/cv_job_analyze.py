@@ -1,4 +1,5 @@
 import sys
+import functools
 import re
 from pathlib import Path
 import gradio as gr
@@ -8,18 +9,25 @@ ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
+from base.cache import get_default_cache
+from base.router import AUTO_MODEL, get_default_router
 from base.utils import get_stream_v2
-from cv_job_analyze import CvJobDescriptionAnalyzer
+from cv_job_analyze_with_Flask import CvJobDescriptionAnalyzer
+
+
+@functools.lru_cache(maxsize=None)
+def get_analyzer(model_name):
+    # One analyzer per model for the whole app, not one per submission, the router
+    # knows which backend serves which model and fails over to the others
+    return CvJobDescriptionAnalyzer(
+        model_name, cache=get_default_cache(), router=get_default_router()
+    )
 
 
 def gradio_app(cv_file, job_desc, model_name):
-    api_key = None
-    if model_name in ["llama3.2", "deepseek-r1:1.5b"]:
-        api_key = "ollama"
-    cv_job_analyzer = CvJobDescriptionAnalyzer(model_name, api_key)
-    cv_job_analyzer.get_cv_content(cv_file=cv_file)
-    cv_job_analyzer.get_job_description(job_desc=job_desc)
-    analyzed_result = cv_job_analyzer.analyze(stream=True)
+    cv_job_analyzer = get_analyzer(model_name)
+    cv_content = cv_job_analyzer.get_cv_content(cv_file)
+    analyzed_result = cv_job_analyzer.analyze(job_desc, cv_content, stream=True)
     yield from get_stream_v2(analyzed_result)
 
 
@@ -31,7 +39,7 @@ def main():
                 file_count="single", file_types=[".pdf"], label="Upload your CV in PDF"
             ),
             gr.Textbox(lines=15, label="Paste the job description here..."),
-            gr.Dropdown(choices=["gpt-4o-mini", "llama3.2", "deepseek-r1:1.5b"]),
+            gr.Dropdown(choices=[AUTO_MODEL] + get_default_router().list_models()),
         ],
         outputs=[
             gr.Markdown(label="CV analyzing result according to the job description:")
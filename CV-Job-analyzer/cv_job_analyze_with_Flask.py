@@ -1,11 +1,13 @@
 import os
 import sys
 import re
+import json
+import uuid
 import argparse
+import threading
 from pathlib import Path
 
-from flask import Flask, render_template, request, Response
-from PyPDF2 import PdfReader
+from flask import Flask, render_template, request, Response, jsonify
 from markdown2 import markdown
 
 FILE = Path(__file__).resolve()
@@ -13,13 +15,23 @@ ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 from base.base_class import BasePromptGenerator
+from base.cache import MemoryCache, get_default_cache
+from base.prompts import render_prompt, static_prompt
+from base.router import POLICIES, build_default_router
 from base.utils import get_stream
+from cv_ingest import MAX_CV_BYTES, get_cv_ingestor
+from structured_analysis import (
+    CV_SECTIONS_SYSTEM_PROMPT,
+    JOB_SECTIONS_SYSTEM_PROMPT,
+    assemble_sections,
+    get_cv_sections_user_prompt,
+    hash_job_description,
+    match_skills,
+    parse_job_sections,
+    parse_json_response,
+)
 
-
-class CvJobDescriptionAnalyzer(BasePromptGenerator):
-    def __init__(self, model_name="gpt-4o-mini", api_key=None):
-        super().__init__(model_name=model_name, api_key=api_key)
-        self.system_prompt = """
+SYSTEM_PROMPT = static_prompt("""
         You are an assistant whose job is to analyze a CV and a job description, \
             then provide a feedback on how well the CV is aligned with \
                 the role described in the job description and its requirements.
@@ -41,45 +53,143 @@ class CvJobDescriptionAnalyzer(BasePromptGenerator):
         7. Job market trend insights, provide broader market trends and insights, \
             such as in-demand skills and salary ranges.
         Provide responses that are concise, clear, and to the point. Respond in markdown.
-        """
-        self.system_prompt = re.sub(r"\t+| {2,}", " ", self.system_prompt)
-        self.user_prompt = None
-        self.job_desc = None
-        self.cv_content = None
-        self.cv_file = None
-        self.analyze_result = None
+        """)
+
+
+USER_PROMPT_TEMPLATE = static_prompt("""
+    Below is the job description and the content of the uploaded CV.
+    Job description:
+    {job_description}
+
+    CV content:
+    {cv_content}
+    """)
+SPACES_RE = re.compile(r"[ \t]+")
+JSON_FORMAT = {"type": "json_object"}
+# Submitted analyses can be streamed for this long, in seconds
+JOB_TTL = 3600
 
-    def get_job_description(self, job_desc):
-        self.job_desc = job_desc
+
+class CvJobDescriptionAnalyzer(BasePromptGenerator):
+    # Holds no request data, so one instance (and its client) serves every analysis
+    def __init__(
+        self,
+        model_name="gpt-4o-mini",
+        api_key=None,
+        cache=None,
+        cv_ingestor=None,
+        max_concurrency=8,
+        job_cache=None,
+        router=None,
+    ):
+        super().__init__(
+            model_name=model_name,
+            api_key=api_key,
+            cache=cache,
+            max_concurrency=max_concurrency,
+            router=router,
+        )
+        self.system_prompt = SYSTEM_PROMPT
+        self.cv_ingestor = cv_ingestor if cv_ingestor is not None else get_cv_ingestor()
+        # Job-only sections of the structured analysis are always cached, keyed on the
+        # job description, and reused for every CV analyzed against the same job
+        self.job_cache = job_cache if job_cache is not None else get_default_cache()
 
     def get_cv_content(self, cv_file):
-        self.cv_file = cv_file
-        if cv_file is not None:
-            self.cv_content = ""
-            pdf_reader = PdfReader(self.cv_file)
-            for page in pdf_reader.pages:
-                self.cv_content += page.extract_text()
+        return self.cv_ingestor.get_text(cv_file)
 
     def get_user_prompt(self, job_description, cv_content):
-        user_prompt = f"""
-            Below is the job description and the content of the uploaded CV.
-            Job description: 
-            {job_description}
+        return render_prompt(
+            USER_PROMPT_TEMPLATE,
+            job_description=SPACES_RE.sub(" ", job_description),
+            cv_content=SPACES_RE.sub(" ", cv_content),
+        )
+
+    def analyze(self, job_desc, cv_content, stream=False):
+        message = self.create_message(
+            self.system_prompt, self.get_user_prompt(job_desc, cv_content)
+        )
+        return self.inference(self.model_name, message, stream)
+
+    async def aanalyze(self, job_desc, cv_content):
+        message = self.create_message(
+            self.system_prompt, self.get_user_prompt(job_desc, cv_content)
+        )
+        return await self.ainference(self.model_name, message)
+
+    def get_job_sections(self, job_desc):
+        message = self.create_message(JOB_SECTIONS_SYSTEM_PROMPT, job_desc)
+        routes = self.get_routes(self.model_name, message)
+        job_sections = self.get_cached_job_sections(routes, job_desc)
+        if job_sections is not None:
+            return job_sections
+        response, model_name = self.complete(routes, message, JSON_FORMAT)
+        return self.save_job_sections(model_name, job_desc, response)
+
+    async def aget_job_sections(self, job_desc):
+        message = self.create_message(JOB_SECTIONS_SYSTEM_PROMPT, job_desc)
+        routes = self.get_routes(self.model_name, message)
+        job_sections = self.get_cached_job_sections(routes, job_desc)
+        if job_sections is not None:
+            return job_sections
+        response, model_name = await self.acomplete(routes, message, JSON_FORMAT)
+        return self.save_job_sections(model_name, job_desc, response)
 
-            CV content:
-            {cv_content}
-        """
+    def get_job_sections_key(self, model_name, job_desc):
+        return f"job-sections:{model_name}:{hash_job_description(job_desc)}"
 
-        return re.sub(r"[ \t]+", " ", user_prompt)
+    def get_cached_job_sections(self, routes, job_desc):
+        # Like the response cache, looked up under the model the router would pick now
+        # and stored under the model that answered, never under 'auto'
+        job_sections = self.job_cache.get(
+            self.get_job_sections_key(routes[0][1], job_desc)
+        )
+        return None if job_sections is None else json.loads(job_sections)
+
+    def save_job_sections(self, model_name, job_desc, response):
+        # Raises a ValueError on an answer that is not a JSON object, never cached
+        job_sections = parse_job_sections(response)
+        self.job_cache.set(
+            self.get_job_sections_key(model_name, job_desc),
+            json.dumps(job_sections, ensure_ascii=False),
+        )
+        return job_sections
+
+    def analyze_structured(self, job_desc, cv_content):
+        # Job-only sections come from the per-job cache, keyword matching and score are
+        # computed locally, the model only writes the CV specific sections
+        job_sections = self.get_job_sections(job_desc)
+        keyword_matching = match_skills(
+            job_sections.get("required_skills", []), cv_content
+        )
+        message = self.create_message(
+            CV_SECTIONS_SYSTEM_PROMPT,
+            get_cv_sections_user_prompt(job_desc, cv_content, keyword_matching),
+        )
+        response = self.inference(self.model_name, message, response_format=JSON_FORMAT)
+        return assemble_sections(
+            job_sections,
+            keyword_matching,
+            parse_json_response(response, "CV sections"),
+        )
 
-    def analyze(self, stream=False):
-        self.user_prompt = self.get_user_prompt(self.job_desc, self.cv_content)
-        if self.user_prompt is None:
-            print("Problem with user prompt")
-            exit(0)
-        message = self.create_message(self.system_prompt, self.user_prompt)
-        self.analyze_result = self.inference(self.model_name, message, stream)
-        return self.analyze_result
+    async def aanalyze_structured(self, job_desc, cv_content):
+        job_sections = await self.aget_job_sections(job_desc)
+        keyword_matching = match_skills(
+            job_sections.get("required_skills", []), cv_content
+        )
+        message = self.create_message(
+            CV_SECTIONS_SYSTEM_PROMPT,
+            get_cv_sections_user_prompt(job_desc, cv_content, keyword_matching),
+        )
+        response = await self.ainference(
+            self.model_name, message, response_format=JSON_FORMAT
+        )
+        return assemble_sections(
+            job_sections,
+            keyword_matching,
+            parse_json_response(response, "CV sections"),
+        )
 
 
 def parse_arguments():
@@ -98,48 +208,118 @@ def parse_arguments():
         default=None,
         help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
     )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
+    parser.add_argument(
+        "--routing_policy",
+        type=str,
+        choices=POLICIES,
+        default=None,
+        help="Route every request between the OpenAI and Ollama backends with this policy, model_name can then be 'auto', default is None to only use the backend of model_name",
+    )
+    parser.add_argument(
+        "--max_jobs",
+        type=int,
+        default=1000,
+        help="Number of submitted analyses kept for streaming, the oldest are dropped first, default is 1000",
+    )
 
     args = parser.parse_args()
     return args
 
 
-def main(model_name, api_key):
-    cv_job_analyzer = CvJobDescriptionAnalyzer(model_name, api_key)
+def main(model_name, api_key, use_cache=False, routing_policy=None, max_jobs=1000):
+    cache = get_default_cache() if use_cache else None
+    router = build_default_router(routing_policy) if routing_policy else None
+    cv_job_analyzer = CvJobDescriptionAnalyzer(
+        model_name, api_key, cache=cache, router=router
+    )
+    # The first recruiter does not pay for the model pull and the connection setup
+    threading.Thread(target=cv_job_analyzer.warm_up, daemon=True).start()
+    # Submissions waiting for (or replaying) their stream, keyed by job id
+    jobs = MemoryCache(max_size=max_jobs, ttl=JOB_TTL)
 
     app = Flask(__name__)
+    # Oversized uploads are refused before being read, with room for the job description
+    app.config["MAX_CONTENT_LENGTH"] = MAX_CV_BYTES + 1024 * 1024
 
     @app.route("/", methods=["GET", "POST"])
     def index():
-        if request.method == "POST":
-            if "text_submit" in request.form:
-                cv_job_analyzer.get_job_description(request.form.get("text_input"))
-            elif "pdf_submit" in request.form:
-                cv_job_analyzer.get_cv_content(request.files["pdf_file"])
-
-            if (cv_job_analyzer.job_desc is not None) and (
-                cv_job_analyzer.cv_content is not None
-            ):
-                cv_job_analyzer.analyze(stream=True)
-                cv_job_analyzer.get_job_description(None)
-                cv_job_analyzer.get_cv_content(None)
+        if request.method == "GET":
+            return render_template("index.html")
 
+        job_desc = request.form.get("text_input", "").strip()
+        cv_file = request.files.get("pdf_file")
+        if not job_desc or cv_file is None or not cv_file.filename:
+            error = "Please provide both the job description and the CV"
+            return (
+                render_template("index.html", error=error, text_content=job_desc),
+                400,
+            )
+        try:
+            cv_content = cv_job_analyzer.get_cv_content(cv_file)
+        except Exception as e:
+            error = f"Could not read the CV: {e}"
+            return (
+                render_template("index.html", error=error, text_content=job_desc),
+                400,
+            )
+
+        job_id = uuid.uuid4().hex
+        jobs.set(
+            job_id,
+            {
+                "job_desc": job_desc,
+                "cv_content": cv_content,
+                "filename": cv_file.filename,
+            },
+        )
         return render_template(
             "index.html",
-            text_content=cv_job_analyzer.job_desc,
-            pdf_file=cv_job_analyzer.cv_file,
-            # analyze_result=analyze_result,
+            job_id=job_id,
+            text_content=job_desc,
+            pdf_filename=cv_file.filename,
         )
 
-    @app.route("/stream")
-    def stream():
-        analyze_result = (
-            get_stream(cv_job_analyzer.analyze_result)
-            if cv_job_analyzer.analyze_result
-            else None
+    @app.route("/stream/<job_id>")
+    def stream(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return Response(
+                "Error: Unknown or expired job", status=404, mimetype="text/plain"
+            )
+        analyze_result = cv_job_analyzer.analyze(
+            job["job_desc"], job["cv_content"], stream=True
         )
-        return Response(analyze_result, mimetype="text/event-stream")
+        return Response(get_stream(analyze_result), mimetype="text/event-stream")
+
+    @app.route("/ready")
+    def ready():
+        # For health checks, a local model is only ready once pulled and loaded
+        is_ready = cv_job_analyzer.is_ready()
+        return jsonify({"model": model_name, "ready": is_ready}), (
+            200 if is_ready else 503
+        )
+
+    @app.route("/structured/<job_id>")
+    def structured(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return Response(
+                "Error: Unknown or expired job", status=404, mimetype="text/plain"
+            )
+        try:
+            sections = cv_job_analyzer.analyze_structured(
+                job["job_desc"], job["cv_content"]
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 502
+        return jsonify(sections)
 
-    app.run()
+    app.run(threaded=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+import re
+import sys
+import json
+import hashlib
+from pathlib import Path
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.prompts import static_prompt
+
+# Weight of a skill in the alignment score
+SKILL_WEIGHTS = {"must_have": 2.0, "nice_to_have": 1.0}
+
+# Only depends on the job description, so it is computed once per job and reused for
+# every CV
+JOB_SECTIONS_SYSTEM_PROMPT = static_prompt("""
+    You are an assistant who analyzes a job description for recruiters.
+    Respond only with a JSON object of the following form:
+    {
+        "job_summary": {"domain": "...", "role": "...", "missions": ["..."], "requirements": ["..."]},
+        "required_skills": [{"skill": "...", "importance": "must_have" or "nice_to_have"}],
+        "market_trends": {"in_demand_skills": ["..."], "salary_range": "...", "insights": ["..."]}
+    }
+    List every skill, tool, technology, language, certification and qualification of the \
+        job description in required_skills, each one as a short keyword (e.g. "python", \
+        "kubernetes", "project management") as it would be written in a CV.
+    """)
+
+# The keyword matching and the score are computed locally and given to the model, which
+# only writes the sections that need the CV
+CV_SECTIONS_SYSTEM_PROMPT = static_prompt("""
+    You are an assistant who gives feedback on how well a CV is aligned with a job \
+        description. The skills of the job found and missing in the CV are already given.
+    Respond only with a JSON object of the following form:
+    {
+        "skill_gaps": [{"skill": "...", "comment": "..."}],
+        "overemphasized": ["..."],
+        "recommendations": ["..."],
+        "personalized_feedback": "..."
+    }
+    skill_gaps explains the missing skills that matter most, overemphasized lists parts \
+        of the CV that are not relevant for the job, recommendations are actionable \
+        suggestions to improve the CV for this job (skills to add, experience to rephrase, \
+        missing keywords to include).
+    """)
+
+
+def hash_job_description(job_desc):
+    normalized = " ".join(job_desc.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def normalize_required_skills(required_skills):
+    # The model sometimes lists plain strings ("Python") instead of objects, or an
+    # importance that is not one of SKILL_WEIGHTS
+    if not isinstance(required_skills, list):
+        return []
+    skills = []
+    for item in required_skills:
+        if isinstance(item, str):
+            item = {"skill": item}
+        if not isinstance(item, dict):
+            continue
+        skill = " ".join(str(item.get("skill") or "").lower().split())
+        if not skill:
+            continue
+        importance = item.get("importance")
+        if importance not in SKILL_WEIGHTS:
+            importance = "must_have"
+        skills.append({"skill": skill, "importance": importance})
+    return skills
+
+
+def match_skills(required_skills, cv_content):
+    cv_text = " ".join(cv_content.lower().split())
+    matched, missing = [], []
+    for entry in normalize_required_skills(required_skills):
+        # Whole words only: "java" is not found in "javascript", "c++" still matches
+        pattern = r"(?<![a-z0-9])" + re.escape(entry["skill"]) + r"(?![a-z0-9])"
+        (matched if re.search(pattern, cv_text) else missing).append(entry)
+    return {"matched": matched, "missing": missing}
+
+
+def compute_alignment_score(keyword_matching):
+    # Share of the weighted job skills found in the CV, from 0 to 100
+    def weight(entry):
+        return SKILL_WEIGHTS.get(entry["importance"], SKILL_WEIGHTS["must_have"])
+
+    total = sum(weight(entry) for group in keyword_matching.values() for entry in group)
+    if not total:
+        return None
+    return round(
+        100 * sum(weight(entry) for entry in keyword_matching["matched"]) / total
+    )
+
+
+def get_cv_sections_user_prompt(job_desc, cv_content, keyword_matching):
+    matched = ", ".join(entry["skill"] for entry in keyword_matching["matched"])
+    missing = ", ".join(entry["skill"] for entry in keyword_matching["missing"])
+    return (
+        f"Skills of the job found in the CV: {matched or 'none'}\n"
+        f"Skills of the job missing from the CV: {missing or 'none'}\n\n"
+        f"Job description:\n{job_desc}\n\nCV content:\n{cv_content}"
+    )
+
+
+def parse_json_response(response, sections_name):
+    try:
+        sections = json.loads(response)
+    except (TypeError, json.JSONDecodeError):
+        sections = None
+    if not isinstance(sections, dict):
+        raise ValueError(
+            f"The model did not answer with a JSON object for the {sections_name}"
+        )
+    return sections
+
+
+def parse_job_sections(response):
+    job_sections = parse_json_response(response, "job sections")
+    job_sections["required_skills"] = normalize_required_skills(
+        job_sections.get("required_skills")
+    )
+    return job_sections
+
+
+def get_list(sections, key):
+    value = sections.get(key)
+    if isinstance(value, list):
+        return value
+    return [value] if value else []
+
+
+def get_section(sections, key):
+    # Summaries are objects in the prompts, a plain text answer is kept as is
+    value = sections.get(key)
+    return value if isinstance(value, (dict, str)) else {}
+
+
+def assemble_sections(job_sections, keyword_matching, cv_sections):
+    # Same seven sections as the free-form analysis, in the same order
+    return {
+        "job_summary": get_section(job_sections, "job_summary"),
+        "skill_gaps": get_list(cv_sections, "skill_gaps"),
+        "overemphasized": get_list(cv_sections, "overemphasized"),
+        "keyword_matching": keyword_matching,
+        "recommendations": get_list(cv_sections, "recommendations"),
+        "alignment_score": compute_alignment_score(keyword_matching),
+        "personalized_feedback": str(cv_sections.get("personalized_feedback") or ""),
+        "market_trends": get_section(job_sections, "market_trends"),
+    }
@@ -1,5 +1,4 @@
 import os
-import re
 import argparse
 from pathlib import Path
 import sys
@@ -12,27 +11,54 @@ ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 from base.base_class import BasePromptGenerator
+from base.cache import get_default_cache, make_cache_key
+from base.prompts import static_prompt
+from base.semantic_cache import SemanticCache
 from base.utils import get_stream_v2
+from history import HistoryManager
 
-
-class AITutor(BasePromptGenerator):
-    def __init__(self, model_name, api_key=None, stream=True):
-        super().__init__(model_name, api_key)
-        self.system_prompt = """
+SYSTEM_PROMPT = static_prompt("""
             You are an AI tutor whose objective is answering the questions on diverse topics, such as Python coding, algorithms, \
             computer vision, large language model, academic research, general knowledge, etc. 
             Your response should be clear, structured and engaging with example code snippets and best practices \
                 if the question is about coding. Use examples, analogies, and step-by-step explainations when needed. \
                 If you don't know the answer, say so. Response in Markdown format.
-        """
-        self.system_prompt = re.sub(r"\t+| {2,}", " ", self.system_prompt)
+        """)
+
+
+class AITutor(BasePromptGenerator):
+    def __init__(
+        self, model_name, api_key=None, stream=True, cache=None, semantic_cache=None
+    ):
+        super().__init__(model_name, api_key, cache=cache)
+        self.system_prompt = SYSTEM_PROMPT
         self.stream = stream
+        self.history_manager = HistoryManager(self, cache=cache)
+        self.semantic_cache = semantic_cache
+        # Answers are only shared between the same model and system prompt
+        self.semantic_namespace = make_cache_key(
+            model_name, [{"role": "system", "content": self.system_prompt}]
+        )
 
     def get_user_message(self, message, history):
         return "", history + [{"role": "user", "content": message}]
 
+    def get_standalone_question(self, history):
+        # Only the first question of a conversation does not depend on earlier turns
+        if self.semantic_cache is None or len(history) != 1:
+            return None
+        return history[0]["content"]
+
     def chat(self, history):
-        messages = [{"role": "system", "content": self.system_prompt}] + history
+        question = self.get_standalone_question(history)
+        if question is not None:
+            answer = self.semantic_cache.get(self.semantic_namespace, question)
+            if answer is not None:
+                print(f"Semantic cache hit: {self.semantic_cache.metrics()}")
+                yield history + [{"role": "assistant", "content": answer}]
+                return
+
+        messages = self.history_manager.build_messages(self.system_prompt, history)
         response = self.inference(
             model_name=self.model_name, message=messages, stream=self.stream
         )
@@ -40,6 +66,10 @@ class AITutor(BasePromptGenerator):
         for chunk in response:
             history[-1]["content"] += chunk.choices[0].delta.content or ""
             yield history
+        if question is not None:
+            self.semantic_cache.set(
+                self.semantic_namespace, question, history[-1]["content"]
+            )
 
 
 def parse_arguments():
@@ -58,12 +88,43 @@ def parse_arguments():
         default=None,
         help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
     )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
+    parser.add_argument(
+        "--semantic_cache",
+        action="store_true",
+        help="Answer a first question similar enough to an earlier one from the cache, without calling the model",
+    )
+    parser.add_argument(
+        "--similarity_threshold",
+        type=float,
+        default=0.92,
+        help="Cosine similarity above which two questions are considered the same, default is 0.92",
+    )
     args = parser.parse_args()
     return args
 
 
-def main(model_name, api_key):
-    tutor = AITutor(model_name=model_name, api_key=api_key, stream=True)
+def main(
+    model_name,
+    api_key,
+    use_cache=False,
+    semantic_cache=False,
+    similarity_threshold=0.92,
+):
+    cache = get_default_cache() if use_cache else None
+    tutor = AITutor(
+        model_name=model_name,
+        api_key=api_key,
+        stream=True,
+        cache=cache,
+        semantic_cache=(
+            SemanticCache(threshold=similarity_threshold) if semantic_cache else None
+        ),
+    )
 
     with gr.Blocks() as ui:
         chatbot = gr.Chatbot(type="messages")
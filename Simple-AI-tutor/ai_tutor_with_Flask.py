@@ -1,23 +1,24 @@
 import os
-import re
+import uuid
 import argparse
 from pathlib import Path
 import sys
 
-from flask import Flask, render_template, Response, request
+from flask import Flask, render_template, Response, request, session, jsonify
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 from base.base_class import BasePromptGenerator
+from base.cache import get_default_cache, make_cache_key, record_stream, replay_stream
+from base.prompts import render_prompt, static_prompt, usage_tracker
+from base.semantic_cache import SemanticCache
 from base.utils import get_stream
+from history import HistoryManager
+from sessions import get_session_store
 
-
-class AITutor(BasePromptGenerator):
-    def __init__(self, model_name, api_key=None):
-        super().__init__(model_name, api_key)
-        self.system_prompt = """
+SYSTEM_PROMPT = static_prompt("""
             You are an AI tutor whose objective is answering the questions on diverse topics, such as Python coding, algorithms, \
             computer vision, large language model, academic research, general knowledge, etc. 
             Your response should be clear, structured and engaging with example code snippets and best practices \
@@ -66,36 +67,58 @@ class AITutor(BasePromptGenerator):
                     Bot: An API (Application Programming Interface) is like a waiter in a restaurant. \
                         Just like a waiter takes your order to the kitchen and brings back food, an API allows \
                             different software applications to communicate. It sends requests and returns responses.        
-            """
-        self.system_prompt = re.sub(r"\t+| {2,}", " ", self.system_prompt)
-        self.last_question = None
-        self.last_response = None
-        self.messages = [{"role": "system", "content": self.system_prompt}]
+            """)
+
+
+# The question comes last so that every request shares the longest possible prefix
+USER_PROMPT_TEMPLATE = static_prompt("""
+    Please respond in Markdown format to my question below.
+    Here is my question:
+    {question}
+    """)
 
-    def get_question(self, question):
-        self.last_question = question
+
+class AITutor(BasePromptGenerator):
+    def __init__(self, model_name, api_key=None, cache=None, semantic_cache=None):
+        super().__init__(model_name, api_key, cache=cache)
+        self.system_prompt = SYSTEM_PROMPT
+        self.history_manager = HistoryManager(self, cache=cache)
+        self.semantic_cache = semantic_cache
+        # Answers are only shared between the same model and system prompt
+        self.semantic_namespace = make_cache_key(
+            model_name, [{"role": "system", "content": self.system_prompt}]
+        )
 
     def get_user_prompt(self, question):
-        user_prompt = f"""
-            Here is my question:
-            {question}
-            Please respond in Markdown format.
-        """
-        user_prompt = re.sub(r"\t+| {2,}", " ", user_prompt)
-        return user_prompt
-
-    def get_response(self, stream=False):
-        if self.last_question is None:
-            return
-
-        self.messages.append(
-            {"role": "user", "content": self.get_user_prompt(self.last_question)}
+        return render_prompt(USER_PROMPT_TEMPLATE, question=question)
+
+    def get_response(self, history, question, stream=False):
+        # Only the first question of a conversation does not depend on earlier turns
+        use_semantic_cache = self.semantic_cache is not None and not history
+        if use_semantic_cache:
+            answer = self.semantic_cache.get(self.semantic_namespace, question)
+            if answer is not None:
+                print(f"Semantic cache hit: {self.semantic_cache.metrics()}")
+                return replay_stream(answer) if stream else answer
+
+        # The tutor keeps no conversation itself, so one instance serves every session
+        messages = self.history_manager.build_messages(
+            self.system_prompt,
+            history + [{"role": "user", "content": self.get_user_prompt(question)}],
         )
-        self.last_response = self.inference(
-            model_name=self.model_name, message=self.messages, stream=stream
+        response = self.inference(
+            model_name=self.model_name, message=messages, stream=stream
         )
-        self.messages.append({"role": "assistant", "content": self.last_response})
-        return self.last_response
+        if not use_semantic_cache:
+            return response
+
+        def save_answer(answer):
+            self.semantic_cache.set(self.semantic_namespace, question, answer)
+
+        if stream:
+            return record_stream(response, save_answer)
+        save_answer(response)
+        return response
 
 
 def parse_arguments():
@@ -114,38 +137,105 @@ def parse_arguments():
         default=None,
         help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
     )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
+    parser.add_argument(
+        "--semantic_cache",
+        action="store_true",
+        help="Answer a first question similar enough to an earlier one from the cache, without calling the model",
+    )
+    parser.add_argument(
+        "--similarity_threshold",
+        type=float,
+        default=0.92,
+        help="Cosine similarity above which two questions are considered the same, default is 0.92",
+    )
+    parser.add_argument(
+        "--redis_url",
+        type=str,
+        default=None,
+        help="Store the conversations in Redis, e.g. redis://localhost:6379/0, default is None to keep them in memory",
+    )
+    parser.add_argument(
+        "--max_sessions",
+        type=int,
+        default=1000,
+        help="Number of conversations kept in memory, the least recently used are dropped first, default is 1000",
+    )
     args = parser.parse_args()
     return args
 
 
-def main(model_name, api_key):
-    tutor = AITutor(model_name=model_name, api_key=api_key)
+def main(
+    model_name,
+    api_key,
+    use_cache=False,
+    semantic_cache=False,
+    similarity_threshold=0.92,
+    redis_url=None,
+    max_sessions=1000,
+):
+    cache = get_default_cache() if use_cache else None
+    tutor = AITutor(
+        model_name=model_name,
+        api_key=api_key,
+        cache=cache,
+        semantic_cache=(
+            SemanticCache(threshold=similarity_threshold) if semantic_cache else None
+        ),
+    )
+    session_store = get_session_store(redis_url, max_sessions=max_sessions)
 
     app = Flask(__name__)
+    # Signs the session cookie, set it to keep the sessions across restarts
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY") or os.urandom(32)
 
     @app.route("/")
     def index():
         return render_template("index.html")
 
-    @app.route("/chat")
-    def chat():
+    @app.route("/stream")
+    def stream():
         user_message = request.args.get("message", "")
 
         if not user_message:
             return Response("Error: Empty message", status=400, mimetype="text/plain")
 
-        tutor.get_question(user_message)  # Store the message for streaming
-        return Response("Message received", mimetype="text/plain")
-
-    @app.route("/stream")
-    def stream():
-        model_response = tutor.get_response(stream=True)
-        if tutor.last_response is not None:
-            return Response(
-                get_stream(tutor.last_response), mimetype="text/event-stream"
+        session_id = session.setdefault("session_id", uuid.uuid4().hex)
+        history = session_store.get_history(session_id)
+        model_response = tutor.get_response(history, user_message, stream=True)
+
+        def save_turn(answer):
+            # Only a fully streamed answer becomes part of the conversation
+            session_store.append_turns(
+                session_id,
+                [
+                    {"role": "user", "content": tutor.get_user_prompt(user_message)},
+                    {"role": "assistant", "content": answer},
+                ],
             )
 
-    app.run()
+        return Response(
+            get_stream(record_stream(model_response, save_turn)),
+            mimetype="text/event-stream",
+        )
+
+    @app.route("/cache_stats")
+    def cache_stats():
+        semantic_cache_stats = "disabled"
+        if tutor.semantic_cache is not None:
+            semantic_cache_stats = tutor.semantic_cache.metrics()
+        return jsonify(
+            {
+                "semantic_cache": semantic_cache_stats,
+                "prompt_cache": usage_tracker.get_stats(),
+            }
+        )
+
+    app.run(threaded=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.cache import MemoryCache
+from base.prompts import static_prompt
+from base.tokens import TOKENS_PER_MESSAGE, count_message_tokens, count_tokens
+
+# Tokens of recent conversation sent verbatim with every question
+WINDOW_TOKENS = 2000
+# Older turns are only summarized once they add up to this many tokens, so that the
+# summary is not rewritten on every turn
+SUMMARIZE_AFTER_TOKENS = 1000
+SUMMARY_MAX_WORDS = 200
+
+
+SUMMARY_SYSTEM_PROMPT = static_prompt("""
+            You maintain the memory of a tutoring conversation. Given the previous summary \
+            and the next turns of the conversation, write an updated summary that keeps the \
+            topics discussed, what the learner already understood or struggled with, and any \
+            code, definitions or facts the learner may refer to later. Respond in plain text.
+        """)
+
+
+class HistoryManager:
+    # Keeps the prompt of every turn to the system prompt, a running summary of the
+    # older turns and a token-budgeted window of the recent ones
+    def __init__(
+        self,
+        generator,
+        window_tokens=WINDOW_TOKENS,
+        summarize_after_tokens=SUMMARIZE_AFTER_TOKENS,
+        cache=None,
+    ):
+        self.generator = generator
+        self.model_name = generator.model_name
+        self.window_tokens = window_tokens
+        self.summarize_after_tokens = summarize_after_tokens
+        # Summaries are keyed by the turns they cover, any conversation (or session)
+        # sharing these turns reuses them
+        self.summaries = cache if cache is not None else MemoryCache(max_size=1024)
+        self.summary_system_prompt = SUMMARY_SYSTEM_PROMPT
+        self.last_prompt_tokens = 0
+
+    def build_messages(self, system_prompt, history):
+        history = [
+            {"role": message["role"], "content": message["content"]}
+            for message in history
+        ]
+        window_start = self.get_window_start(history)
+        summarized, summary = self.get_cached_summary(history, window_start)
+        # Turns between the summary and the window are kept verbatim until there
+        # are enough of them to be worth a summary call
+        if (
+            count_message_tokens(history[summarized:window_start], self.model_name)
+            > self.summarize_after_tokens
+        ):
+            new_summary = self.summarize(history, summarized, window_start, summary)
+            # Without an answer the turns stay verbatim, they are summarized next turn
+            if new_summary is not None:
+                summary, summarized = new_summary, window_start
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{summary}",
+                }
+            )
+        messages += history[summarized:]
+        self.last_prompt_tokens = count_message_tokens(messages, self.model_name)
+        print(
+            f"Prompt tokens for this turn: {self.last_prompt_tokens} "
+            f"({len(history) - summarized} messages kept, {summarized} summarized)"
+        )
+        return messages
+
+    def get_window_start(self, history):
+        # The most recent messages fitting in the window, the last one is always kept
+        used = 0
+        window_start = len(history)
+        while window_start > 0:
+            message = history[window_start - 1]
+            cost = (
+                count_tokens(message["content"], self.model_name) + TOKENS_PER_MESSAGE
+            )
+            if window_start < len(history) and used + cost > self.window_tokens:
+                break
+            used += cost
+            window_start -= 1
+        # The window starts with a question, not with the answer of a dropped one
+        while (
+            0 < window_start < len(history) and history[window_start]["role"] != "user"
+        ):
+            window_start += 1
+        return window_start
+
+    def get_cached_summary(self, history, window_start):
+        # Longest prefix of the conversation that was already summarized
+        for end, key in reversed(list(enumerate(self.prefix_keys(history), start=1))):
+            if end > window_start:
+                continue
+            summary = self.summaries.get(key)
+            if summary is not None:
+                return end, summary
+        return 0, ""
+
+    def summarize(self, history, start, end, previous_summary):
+        turns = "\n\n".join(
+            f"{message['role']}: {message['content']}" for message in history[start:end]
+        )
+        user_prompt = (
+            f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+            f"Next turns:\n{turns}\n\n"
+            f"Write the updated summary in at most {SUMMARY_MAX_WORDS} words."
+        )
+        summary = self.generator.inference(
+            model_name=self.model_name,
+            message=[
+                {"role": "system", "content": self.summary_system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+        )
+        if summary is None:
+            print(f"No summary returned for {end - start} messages")
+            return None
+        print(
+            f"Summarized {end - start} messages into "
+            f"{count_tokens(summary, self.model_name)} tokens"
+        )
+        self.summaries.set(self.prefix_keys(history[:end])[-1], summary)
+        return summary
+
+    def prefix_keys(self, history):
+        # Hash chain, the key of a prefix only depends on the messages it contains
+        keys = []
+        digest = b""
+        for message in history:
+            payload = json.dumps(message, sort_keys=True, ensure_ascii=False)
+            digest = hashlib.sha256(digest + payload.encode("utf-8")).digest()
+            keys.append("history-summary:" + digest.hex())
+        return keys
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Conversations not used for this long are dropped, in seconds
+SESSION_TTL = 24 * 3600
+
+
+class MemorySessionStore:
+    # Conversation history of every session in this process, the least recently used
+    # sessions are evicted first
+    def __init__(self, max_sessions=1000, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_history(self, session_id):
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return []
+            history, last_used = item
+            if self.ttl is not None and time.time() - last_used > self.ttl:
+                del self._sessions[session_id]
+                return []
+            self._sessions.move_to_end(session_id)
+            # A copy, so that a request never sees another request's changes midway
+            return list(history)
+
+    def append_turns(self, session_id, turns):
+        with self._lock:
+            history, _ = self._sessions.get(session_id, ([], None))
+            self._sessions[session_id] = (history + list(turns), time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore:
+    # Same interface backed by any client with the redis list commands (redis.Redis,
+    # fakeredis, ...), so several server processes can share the sessions
+    def __init__(self, client, ttl=SESSION_TTL, prefix="ai-tutor:session:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_history(self, session_id):
+        return [
+            json.loads(message)
+            for message in self.client.lrange(self.prefix + session_id, 0, -1)
+        ]
+
+    def append_turns(self, session_id, turns):
+        key = self.prefix + session_id
+        # RPUSH is atomic, concurrent turns of one session are never lost
+        self.client.rpush(
+            key, *[json.dumps(turn, ensure_ascii=False) for turn in turns]
+        )
+        if self.ttl is not None:
+            self.client.expire(key, int(self.ttl))
+
+    def clear(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def get_session_store(redis_url=None, max_sessions=1000, ttl=SESSION_TTL):
+    if redis_url is None:
+        return MemorySessionStore(max_sessions=max_sessions, ttl=ttl)
+    if redis is None:
+        raise ImportError("Install the redis package to store sessions in Redis")
+    return RedisSessionStore(redis.Redis.from_url(redis_url), ttl=ttl)
@@ -1,6 +1,15 @@
 from pathlib import Path
+import os
 import sys
 import json
+import asyncio
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 import pandas as pd
 import numpy as np
 from faker import Faker
@@ -11,6 +20,9 @@ ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 from base.base_class import BasePromptGenerator
+from base.cache import get_default_cache
+from base.prompts import static_prompt
+from dataset_writers import check_row_limit, get_chunk_writer
 
 system_message = """
 You are a data analyst assistant. You are given a business problem and dataset requirements, then you have to analyze and output a structured JSON instruction for synthetic dataset generation. 
@@ -39,81 +51,268 @@ user_message = f"""
 Business problem and requirements:
 {user_input}
 """
-prompt_generator = BasePromptGenerator("gpt-4o-mini")
+prompt_generator = BasePromptGenerator("gpt-4o-mini", cache=get_default_cache())
 system_prompt = {"role": "system", "content": system_message}
 user_prompt = {"role": "user", "content": user_message}
 
+COMPLEX_BATCH_SYSTEM_PROMPT = static_prompt("""
+    You are generating synthetic data for a tabular dataset.
+    You are given an entity, the field to generate and the contexts of several rows.
+    Instructions:
+    - Generate a realistic and contextually appropriate value for the field of every row.
+    - Make sure each value matches the expected type and style for this field and its own row context.
+    - Do not repeat the context or field name in the values.
+    - Output only a JSON object of the form {"values": [{"index": <row number>, "value": "<generated value>"}]} with exactly one item per row.
+    """)
+
 SIMPLE_TYPES = {"int", "integer", "float", "decimal", "string"}
 COMPLEX_ROLES = {"free_text", "description", "review", "comment"}
+# Number of rows packed into one LLM request for complex columns
+COMPLEX_BATCH_SIZE = 20
+COMPLEX_BATCH_MAX_RETRIES = 2
+# Number of distinct Faker values drawn per string column, larger tables sample them
+# with replacement: a bigger pool gives more distinct names and products at the cost
+# of Faker time and memory, set it to the row count to never repeat a value
+FAKE_POOL_SIZE = 2_000
+# Faker columns that must not repeat, their pooled values get a row id suffix
+UNIQUE_FAKE_COLUMNS = {"email"}
+# Number of rows generated and written at once, bounds the peak memory
+CHUNK_SIZE = 100_000
 
 fake = Faker()
+fake_lock = threading.Lock()
+_event_loop = None
+_event_loop_pid = None
+_event_loop_lock = threading.Lock()
+FAKE_STRING_GENERATORS = {
+    "name": lambda: fake.name(),
+    "email": lambda: fake.email(),
+    "product": lambda: fake.word().title(),
+}
 
 
-def generate_datasets(instruction_json):
+def generate_datasets(
+    instruction_json,
+    seed=None,
+    chunk_size=CHUNK_SIZE,
+    output_dir=".",
+    executor="thread",
+    max_workers=None,
+    fake_pool_size=FAKE_POOL_SIZE,
+):
     if not isinstance(instruction_json, dict):
         instruction_json = json.loads(instruction_json)
-    dict_primary_keys_by_entity = dict()
-    dict_generated_dataset = dict()
-    for entity in instruction_json["entities"]:
-        # Generate primary entities first
-        if not any(c.get("role") == "foreign_key" for c in entity["columns"]):
-            df, dict_primary_keys = generate_one_dataset(entity=entity)
-            dict_primary_keys_by_entity[entity["name"]] = dict_primary_keys
-            dict_generated_dataset[entity["name"]] = df
-
-    for entity in instruction_json["entities"]:
-        # Generate primary entities first
-        if any(c.get("role") == "foreign_key" for c in entity["columns"]):
-            df, dict_primary_keys = generate_one_dataset(
-                entity=entity, dict_primary_keys_by_entity=dict_primary_keys_by_entity
-            )
-            dict_primary_keys_by_entity[entity["name"]] = dict_primary_keys
-            dict_generated_dataset[entity["name"]] = df
-
-    excel_file_paths = []
+    entities = instruction_json["entities"]
+    formats = instruction_json.get("formats") or dict()
+    # Fails before anything is generated if the references are unknown or cyclic, or
+    # if a table does not fit its file format
+    dependencies = get_entity_dependencies(entities)
+    for entity in entities:
+        check_row_limit(entity["name"], entity["count"], formats.get(entity["name"]))
+    # One independent stream per entity keeps the output reproducible whatever the scheduling order
+    rngs = {
+        e["name"]: np.random.default_rng(seed_seq)
+        for e, seed_seq in zip(
+            entities, np.random.SeedSequence(seed).spawn(len(entities))
+        )
+    }
+    entities_by_name = {e["name"]: e for e in entities}
+
+    # Entities are submitted as soon as all the entities they reference are done,
+    # so the total time follows the longest reference chain instead of the sum
+    executor_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    results = dict()
+    running = dict()
+    with executor_cls(max_workers=max_workers) as pool:
+
+        def submit_ready_entities():
+            for name, deps in dependencies.items():
+                if name in results or name in running.values():
+                    continue
+                if deps.issubset(results):
+                    entity = entities_by_name[name]
+                    referenced = deps | {name}
+                    future = pool.submit(
+                        save_one_dataset,
+                        entity=entity,
+                        file_format=formats.get(name),
+                        dict_primary_key_counts_by_entity={
+                            ref: get_primary_key_counts(entities_by_name[ref])
+                            for ref in referenced
+                        },
+                        rng=rngs[name],
+                        chunk_size=chunk_size,
+                        output_dir=output_dir,
+                        fake_pool_size=fake_pool_size,
+                    )
+                    running[future] = name
+
+        submit_ready_entities()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+            submit_ready_entities()
+
+    file_paths = []
     print_dfs = []
-    for name, df in dict_generated_dataset.items():
-        excel_save_path = name + ".xlsx"
-        df.to_excel(excel_save_path, index=False)
-        excel_file_paths.append(excel_save_path)
-        print_dfs.append(df.head(3).to_markdown(index=False))
-    output_text = (
-        f"{len(excel_file_paths)} Excel files are saved at {excel_file_paths} \n"
-    )
-    for excel_file_path, print_df in zip(excel_file_paths, print_dfs):
-        output_text += f"### {excel_file_path}\n"
+    for entity in entities:
+        file_path, preview_df = results[entity["name"]]
+        file_paths.append(file_path)
+        print_dfs.append(preview_df.to_markdown(index=False))
+    output_text = f"{len(file_paths)} files are saved at {file_paths} \n"
+    for file_path, print_df in zip(file_paths, print_dfs):
+        output_text += f"### {file_path}\n"
         output_text += f"{print_df}\n"
     return output_text
 
 
-def generate_one_dataset(entity, dict_primary_keys_by_entity=None):
-    rows = []
-    name = entity["name"]
-    n_rows = entity["count"]
-    primary_keys = list(range(n_rows))
-    primary_columns = [c for c in entity["columns"] if c.get("role") == "primary_key"]
-    dict_primary_keys = {c["name"]: primary_keys for c in primary_columns}
-    # each row : {'col1': value, 'col2': value}
-    for i in range(n_rows):
-        row = dict()
+def get_entity_dependencies(entities):
+    names = [e["name"] for e in entities]
+    dependencies = dict()
+    for entity in entities:
+        deps = set()
         for c in entity["columns"]:
-            if c.get("role", "") == "foreign_key":
-                ref = c.get("references")
-                ref_name, ref_col = ref.split(".")
-                value = np.random.choice(
-                    dict_primary_keys_by_entity.get(ref_name).get(ref_col)
+            if c.get("role") != "foreign_key":
+                continue
+            ref_name = c.get("references", "").split(".")[0]
+            if ref_name not in names:
+                raise ValueError(
+                    f"{entity['name']}.{c['name']} references unknown entity '{ref_name}'"
                 )
-            else:
-                value = generate_value_one_column(column=c, row_idx=i)
-            row[c["name"]] = value
+            # Self references only need the entity's own key range
+            if ref_name != entity["name"]:
+                deps.add(ref_name)
+        dependencies[entity["name"]] = deps
+
+    # Kahn's algorithm, whatever cannot be ordered is part of a cycle
+    remaining = {name: set(deps) for name, deps in dependencies.items()}
+    ordered = set()
+    ready = [name for name in names if not remaining[name]]
+    while ready:
+        name = ready.pop()
+        ordered.add(name)
+        for other, deps in remaining.items():
+            if name in deps:
+                deps.discard(name)
+                if not deps and other not in ordered:
+                    ready.append(other)
+    if len(ordered) < len(dependencies):
+        cyclic = sorted(set(dependencies) - ordered)
+        raise ValueError(f"Cyclic references between entities: {cyclic}")
+    return dependencies
+
+
+def save_one_dataset(
+    entity,
+    file_format=None,
+    dict_primary_key_counts_by_entity=None,
+    rng=None,
+    chunk_size=CHUNK_SIZE,
+    output_dir=".",
+    fake_pool_size=FAKE_POOL_SIZE,
+):
+    check_row_limit(entity["name"], entity["count"], file_format)
+    # Chunks are written as soon as they are generated, so memory stays bounded by chunk_size
+    writer = get_chunk_writer(entity["name"], file_format, output_dir)
+    preview_df = pd.DataFrame(columns=[c["name"] for c in entity["columns"]])
+    try:
+        for chunk_idx, df in enumerate(
+            generate_dataset_chunks(
+                entity,
+                dict_primary_key_counts_by_entity,
+                rng=rng,
+                chunk_size=chunk_size,
+                fake_pool_size=fake_pool_size,
+            )
+        ):
+            if chunk_idx == 0:
+                preview_df = df.head(3)
+            writer.write(df)
+    finally:
+        writer.close()
+    return writer.path, preview_df
+
+
+def get_primary_key_counts(entity):
+    # Primary keys are always 0..count-1, so the count is all foreign keys need, not
+    # the keys themselves
+    primary_columns = [c for c in entity["columns"] if c.get("role") == "primary_key"]
+    return {c["name"]: entity["count"] for c in primary_columns}
 
-        for c in entity["columns"]:
-            if not is_simple_column(c) and row[c["name"]] is None:
-                value = generate_complex_value(entity["name"], c, row)
-                row[c["name"]] = value
-        rows.append(row)
-    df = pd.DataFrame(rows)
-    return df, dict_primary_keys
+
+def generate_dataset_chunks(
+    entity,
+    dict_primary_key_counts_by_entity=None,
+    batch_size=COMPLEX_BATCH_SIZE,
+    rng=None,
+    chunk_size=CHUNK_SIZE,
+    fake_pool_size=FAKE_POOL_SIZE,
+):
+    rng = np.random.default_rng() if rng is None else rng
+    # Chunks share one pool of Faker values per column, drawn for the whole entity, so
+    # the generated values do not depend on chunk_size
+    fake_pools = build_fake_pools(entity, rng, fake_pool_size)
+    for start in range(0, entity["count"], chunk_size):
+        yield generate_one_chunk(
+            entity,
+            start,
+            min(chunk_size, entity["count"] - start),
+            dict_primary_key_counts_by_entity,
+            batch_size=batch_size,
+            rng=rng,
+            fake_pools=fake_pools,
+        )
+
+
+def generate_one_chunk(
+    entity,
+    start,
+    n_rows,
+    dict_primary_key_counts_by_entity=None,
+    batch_size=COMPLEX_BATCH_SIZE,
+    rng=None,
+    fake_pools=None,
+):
+    # each column : {'col1': array of n_rows values, ...}
+    columns = dict()
+    for c in entity["columns"]:
+        if c.get("role", "") == "foreign_key":
+            ref = c.get("references")
+            ref_name, ref_col = ref.split(".")
+            columns[c["name"]] = rng.integers(
+                0,
+                dict_primary_key_counts_by_entity.get(ref_name).get(ref_col),
+                size=n_rows,
+            )
+        else:
+            columns[c["name"]] = generate_value_one_column(
+                column=c,
+                n_rows=n_rows,
+                rng=rng,
+                start=start,
+                fake_pools=fake_pools,
+                n_total=entity["count"],
+            )
+    df = pd.DataFrame(columns, index=pd.RangeIndex(start, start + n_rows))
+
+    run_coroutine(afill_complex_columns(entity, df, batch_size))
+    return df
+
+
+def run_coroutine(coro):
+    # The entities generated in parallel threads all send their LLM requests through
+    # one event loop, so the prompt generator's max_concurrency caps them together
+    # (with executor="process", every worker process has its own loop and cap)
+    # A forked worker inherits the loop but not the thread running it, so a new one is
+    # started whenever the process changes
+    global _event_loop, _event_loop_pid
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop_pid != os.getpid():
+            _event_loop = asyncio.new_event_loop()
+            _event_loop_pid = os.getpid()
+            threading.Thread(target=_event_loop.run_forever, daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop).result()
 
 
 def is_simple_column(column):
@@ -124,19 +323,37 @@ def is_simple_column(column):
     return False
 
 
-def generate_value_one_column(column, row_idx: int):
+def generate_value_one_column(
+    column,
+    n_rows: int,
+    rng: np.random.Generator,
+    start: int = 0,
+    fake_pools: None | dict = None,
+    n_total: None | int = None,
+):
     if is_simple_column(column):
-        value = generate_simple_value(
-            column, row_idx=row_idx, numeric_constraints=column.get("constraints")
+        values = generate_simple_column(
+            column,
+            n_rows=n_rows,
+            rng=rng,
+            numeric_constraints=column.get("constraints"),
+            start=start,
+            fake_pools=fake_pools,
+            n_total=n_total,
         )
-        return value
     else:
-        value = None
-    return value
-
-
-def generate_simple_value(
-    column, row_idx: int, numeric_constraints: None | list = None
+        values = [None] * n_rows
+    return values
+
+
+def generate_simple_column(
+    column,
+    n_rows: int,
+    rng: np.random.Generator,
+    numeric_constraints: None | list = None,
+    start: int = 0,
+    fake_pools: None | dict = None,
+    n_total: None | int = None,
 ):
     assert numeric_constraints is None or (
         isinstance(numeric_constraints, list) and len(numeric_constraints) == 2
@@ -146,37 +363,160 @@ def generate_simple_value(
     role = column.get("role")
     if type == "integer" or type == "int":
         if (role is not None) and (role.lower() == "primary_key"):
-            value = row_idx
+            values = np.arange(start, start + n_rows)
         else:
-            value = (
-                np.random.randint(1, 1000)
-                if numeric_constraints is None
-                else np.random.randint(numeric_constraints[0], numeric_constraints[1])
+            low, high = (
+                (1, 1000) if numeric_constraints is None else numeric_constraints
             )
+            values = rng.integers(low, high, size=n_rows)
     elif type == "float" or type == "decimal":
-        value = (
-            round(np.random.uniform(1.0, 1000.0), 2)
-            if numeric_constraints is None
-            else round(
-                np.random.uniform(numeric_constraints[0], numeric_constraints[1]), 2
-            )
+        low, high = (
+            (1.0, 1000.0) if numeric_constraints is None else numeric_constraints
         )
+        values = np.round(rng.uniform(low, high, size=n_rows), 2)
     elif type == "string":
-        if name == "name":
-            value = fake.name()
-        elif name == "email":
-            value = fake.email()
-        elif name == "product":
-            value = fake.word().title()
+        fake_func = FAKE_STRING_GENERATORS.get(name)
+        if fake_func is None:
+            values = [None] * n_rows
         else:
-            value = None
-    return value
+            # Rows of the whole table, this chunk being rows start..start+n_rows
+            n_total = start + n_rows if n_total is None else n_total
+            pool = (fake_pools or dict()).get(name)
+            if pool is None:
+                pool = draw_fake_pool(fake_func, min(n_total, FAKE_POOL_SIZE), rng)
+            values = take_fake_values(pool, start, n_rows, n_total, rng)
+            if name in UNIQUE_FAKE_COLUMNS:
+                values = make_unique_values(values, start)
+    return values
+
+
+def draw_fake_pool(fake_func, pool_size, rng):
+    # Faker only generates one value per call, so a bounded pool is drawn once
+    # and sampled in a single vectorized call
+    with fake_lock:
+        # the Faker instance is shared by the entities generated in parallel threads
+        fake.seed_instance(int(rng.integers(2**32)))
+        return np.array([fake_func() for _ in range(pool_size)], dtype=object)
+
+
+def take_fake_values(pool, start, n_rows, n_total, rng):
+    # A pool covering the whole table gives every row its own value, a smaller one is
+    # sampled with replacement, in both cases however the table is chunked
+    if len(pool) >= n_total:
+        return pool[start : start + n_rows]
+    return rng.choice(pool, size=n_rows)
+
+
+def make_unique_values(values, start):
+    # The row id is inserted before the domain of emails ("jane.doe.42@example.com"),
+    # or appended to other values, so pooled values never repeat
+    values = np.asarray(values, dtype=object)
+    row_ids = np.arange(start, start + len(values)).astype(str).astype(object)
+    parts = pd.Series(values, dtype=object).str.rpartition("@")
+    has_domain = (parts[1] == "@").to_numpy()
+    local = np.where(has_domain, parts[0].to_numpy(dtype=object), values)
+    domain = np.where(has_domain, "@" + parts[2].to_numpy(dtype=object), "")
+    return local + "." + row_ids + domain
+
+
+def build_fake_pools(entity, rng, fake_pool_size=FAKE_POOL_SIZE):
+    pool_size = min(entity["count"], fake_pool_size)
+    fake_pools = dict()
+    for c in entity["columns"]:
+        name = c["name"].lower()
+        if is_simple_column(c) and c["type"] == "string":
+            if name in FAKE_STRING_GENERATORS:
+                fake_pools[name] = draw_fake_pool(
+                    FAKE_STRING_GENERATORS[name], pool_size, rng
+                )
+    return fake_pools
+
+
+async def afill_complex_columns(entity, df, batch_size=COMPLEX_BATCH_SIZE):
+    complex_columns = [c for c in entity["columns"] if not is_simple_column(c)]
+    if not complex_columns:
+        return df
+    # Complex columns are filled column by column so later ones see earlier ones in their context
+    rows = df.to_dict("records")
+    for c in complex_columns:
+        pending_idx = [i for i, row in enumerate(rows) if row[c["name"]] is None]
+        values = await agenerate_complex_values(
+            entity["name"], c, [rows[i] for i in pending_idx], batch_size
+        )
+        for i, value in zip(pending_idx, values):
+            rows[i][c["name"]] = value
+        df[c["name"]] = [row[c["name"]] for row in rows]
+    return df
 
 
-def generate_complex_value(entity_name, column_info, row):
-    messages = generate_message_for_complex_value(entity_name, column_info, row)
-    response = prompt_generator.inference(prompt_generator.model_name, messages)
-    return response
+async def agenerate_complex_values(
+    entity_name, column_info, rows, batch_size=COMPLEX_BATCH_SIZE
+):
+    # Batches run concurrently, capped by the prompt generator's max_concurrency;
+    # gather keeps the batch order so values line up with the input rows
+    batches = [
+        rows[start : start + batch_size] for start in range(0, len(rows), batch_size)
+    ]
+    batch_values = await asyncio.gather(
+        *[
+            agenerate_complex_batch(entity_name, column_info, batch_rows)
+            for batch_rows in batches
+        ]
+    )
+    return [value for values in batch_values for value in values]
+
+
+async def agenerate_complex_batch(
+    entity_name, column_info, rows, max_retries=COMPLEX_BATCH_MAX_RETRIES
+):
+    values = dict()
+    pending = list(range(len(rows)))
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        messages = generate_message_for_complex_batch(
+            entity_name, column_info, [rows[i] for i in pending]
+        )
+        try:
+            response = await prompt_generator.ainference(
+                prompt_generator.model_name,
+                messages,
+                response_format={"type": "json_object"},
+                use_cache=(attempt == 0),
+            )
+            items = json.loads(response)["values"]
+        except Exception as e:
+            print(
+                f"Batch generation of {column_info['name']} failed at attempt {attempt + 1}: {e}"
+            )
+            continue
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("index")
+            if isinstance(idx, int) and 0 <= idx < len(pending) and "value" in item:
+                values[pending[idx]] = str(item["value"])
+        # Only the rows missing from the answer are sent again
+        pending = [i for i in pending if i not in values]
+
+    if pending:
+        print(
+            f"Falling back to single row generation of {column_info['name']} for {len(pending)} rows"
+        )
+        # Sent concurrently, still within the prompt generator's max_concurrency
+        fallback_values = await asyncio.gather(
+            *[
+                prompt_generator.ainference(
+                    prompt_generator.model_name,
+                    generate_message_for_complex_value(
+                        entity_name, column_info, rows[i]
+                    ),
+                )
+                for i in pending
+            ]
+        )
+        values.update(zip(pending, fallback_values))
+    return [values[i] for i in range(len(rows))]
 
 
 def generate_context_for_complex_value(row):
@@ -211,6 +551,23 @@ def generate_message_for_complex_value(entity_name, column_info, row):
     return messages
 
 
+def generate_message_for_complex_batch(entity_name, column_info, rows):
+    contexts = ""
+    for idx, row in enumerate(rows):
+        contexts += f"Row {idx}:\n{generate_context_for_complex_value(row)}\n"
+    # The instructions are the same for every batch, only the rows vary and come last
+    user_message = f"""Entity: {entity_name}
+Field to generate: {column_info['name']}, type: {column_info['type']}
+
+Contexts of the {len(rows)} rows:
+{contexts}"""
+    messages = [
+        {"role": "system", "content": COMPLEX_BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+    return messages
+
+
 if __name__ == "__main__":
 
     def get_response(user_input):
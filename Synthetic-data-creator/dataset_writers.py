@@ -0,0 +1,130 @@
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+EXCEL_MAX_ROWS = 1_048_576
+FORMAT_ALIASES = {
+    "csv": "csv",
+    "json": "jsonl",
+    "jsonl": "jsonl",
+    "json lines": "jsonl",
+    "parquet": "parquet",
+    "excel": "xlsx",
+    "xlsx": "xlsx",
+}
+
+
+class CsvChunkWriter:
+    extension = ".csv"
+
+    def __init__(self, path):
+        self.path = path
+        self.n_rows = 0
+
+    def write(self, df):
+        df.to_csv(
+            self.path,
+            mode="a" if self.n_rows else "w",
+            header=not self.n_rows,
+            index=False,
+        )
+        self.n_rows += len(df)
+
+    def close(self):
+        pass
+
+
+class JsonLinesChunkWriter:
+    extension = ".jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, df):
+        if df.empty:
+            return
+        records = df.to_json(orient="records", lines=True, force_ascii=False)
+        # Older pandas versions do not end the last record with a newline, newer ones do
+        self.file.write(records if records.endswith("\n") else records + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter:
+    extension = ".parquet"
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ExcelChunkWriter:
+    extension = ".xlsx"
+
+    def __init__(self, path):
+        self.path = path
+        # write-only mode streams rows to disk instead of keeping the whole sheet in memory
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.n_rows = 0
+
+    def write(self, df):
+        if self.n_rows == 0:
+            self.sheet.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None):
+            self.sheet.append([to_python_value(value) for value in row])
+        self.n_rows += len(df)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+CHUNK_WRITERS = {
+    "csv": CsvChunkWriter,
+    "jsonl": JsonLinesChunkWriter,
+    "parquet": ParquetChunkWriter,
+    "xlsx": ExcelChunkWriter,
+}
+
+
+def to_python_value(value):
+    # openpyxl only accepts builtin types, not numpy scalars
+    return value.item() if hasattr(value, "item") else value
+
+
+def normalize_format(file_format, default="xlsx"):
+    if not file_format:
+        return default
+    return FORMAT_ALIASES.get(str(file_format).strip().lower(), default)
+
+
+def check_row_limit(name, n_rows, file_format):
+    # Checked before generating anything, so no LLM column is paid for a file that
+    # cannot be written
+    if normalize_format(file_format) == "xlsx" and n_rows + 1 > EXCEL_MAX_ROWS:
+        raise ValueError(
+            f"{name} has {n_rows} rows, with the header they do not fit in Excel's "
+            f"{EXCEL_MAX_ROWS} rows, use csv, jsonl or parquet instead"
+        )
+
+
+def get_chunk_writer(name, file_format, output_dir="."):
+    writer_cls = CHUNK_WRITERS[normalize_format(file_format)]
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    return writer_cls(str(Path(output_dir) / (name + writer_cls.extension)))
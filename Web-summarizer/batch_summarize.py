@@ -0,0 +1,190 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.cache import get_default_cache
+from web_summarize import WebsiteSummarizer
+
+# Print the throughput every this many finished websites
+REPORT_EVERY = 10
+
+
+def load_urls(urls_file):
+    urls = []
+    seen = set()
+    for line in open(urls_file, encoding="utf-8"):
+        url = line.strip()
+        if url and not url.startswith("#") and url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def load_checkpoint(output_path):
+    # The output file is the checkpoint: websites already summarized are skipped,
+    # failed ones are tried again
+    done_urls = set()
+    if not Path(output_path).exists():
+        return done_urls
+    for line in open(output_path, encoding="utf-8"):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # Last line cut by an interruption
+            continue
+        if record.get("status") == "ok":
+            done_urls.add(record["url"])
+    return done_urls
+
+
+def summarize_website(url, **summarizer_kwargs):
+    start = time.time()
+    try:
+        web_summarizer = WebsiteSummarizer(url, screenshot=False, **summarizer_kwargs)
+        summary = web_summarizer.get_summary(stream=False)
+        record = {"url": url, "status": "ok", "title": web_summarizer.title}
+        record["summary"] = summary
+    except Exception as e:
+        record = {"url": url, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    record["elapsed"] = round(time.time() - start, 2)
+    return record
+
+
+def run_batch(urls_file, output_path, workers=4, **summarizer_kwargs):
+    urls = load_urls(urls_file)
+    done_urls = load_checkpoint(output_path)
+    pending_urls = [url for url in urls if url not in done_urls]
+    print(
+        f"{len(urls)} websites, {len(done_urls & set(urls))} already summarized, "
+        f"{len(pending_urls)} to go with {workers} workers"
+    )
+
+    start = time.time()
+    n_finished, n_failed = 0, 0
+    pending_iter = iter(pending_urls)
+    in_flight = set()
+    with open(output_path, "a", encoding="utf-8") as output_file, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+
+        def fill_queue():
+            # Only a few websites are queued ahead of the workers, not the whole file
+            while len(in_flight) < 2 * workers:
+                url = next(pending_iter, None)
+                if url is None:
+                    return
+                in_flight.add(
+                    executor.submit(summarize_website, url, **summarizer_kwargs)
+                )
+
+        fill_queue()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight.discard(future)
+                record = future.result()
+                # Written as soon as it finishes, so an interruption loses nothing
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output_file.flush()
+                n_finished += 1
+                if record["status"] != "ok":
+                    n_failed += 1
+                    print(f"Failed {record['url']}: {record['error']}")
+                if n_finished % REPORT_EVERY == 0:
+                    report_throughput(n_finished, n_failed, len(pending_urls), start)
+            fill_queue()
+    report_throughput(n_finished, n_failed, len(pending_urls), start)
+
+
+def report_throughput(n_finished, n_failed, n_total, start):
+    elapsed = time.time() - start
+    rate = n_finished / elapsed * 60 if elapsed > 0 else 0.0
+    print(
+        f"{n_finished}/{n_total} websites done ({n_failed} failed) "
+        f"in {elapsed:.0f}s, {rate:.1f} websites/min"
+    )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Summarize many websites headlessly, results are written to a JSON Lines file"
+    )
+    parser.add_argument(
+        "urls_file", type=str, help="File with one website url per line"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="summaries.jsonl",
+        help="JSON Lines output, also used to resume an interrupted run, default is summaries.jsonl",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of websites processed at the same time, default is 4",
+    )
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default="gpt-4o-mini",
+        help="Model name for text generation, currently support OpenAI GPT and open-source Ollama (need to use 'ollama' api key) models, default is gpt-4o-mini",
+    )
+    parser.add_argument(
+        "--api_key",
+        type=str,
+        default=None,
+        help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
+    )
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=6000,
+        help="Maximum number of tokens of website content put in the summary prompt, default is 6000",
+    )
+    parser.add_argument(
+        "--map_reduce",
+        action="store_true",
+        help="Summarize every page concurrently then merge the page summaries, for very large websites",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main(
+    urls_file,
+    output,
+    workers,
+    model_name,
+    api_key,
+    token_budget=6000,
+    map_reduce=False,
+    use_cache=False,
+):
+    run_batch(
+        urls_file,
+        output,
+        workers=workers,
+        model_name=model_name,
+        api_key=api_key,
+        cache=get_default_cache() if use_cache else None,
+        token_budget=token_budget,
+        map_reduce=map_reduce,
+    )
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(**vars(args))
@@ -0,0 +1,124 @@
+import argparse
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import extraction
+from fetcher import fetch_static_page, get_static_html
+
+
+def extract_page_bs4(page_source, base_url=""):
+    # Reference: the BeautifulSoup implementation scrape_website used before extraction.py,
+    # with its links normalized like the single pass ones so that they can be compared
+    title = None
+    soup = BeautifulSoup(page_source, "html.parser")
+    if soup.title:
+        title = soup.title.string
+    if soup.body:
+        for irrelevant in soup.body(["script", "type", "img", "input"]):
+            irrelevant.decompose()
+        content = soup.get_text(separator="\n", strip=True)
+    else:
+        content = ""
+    links = extraction.resolve_links(
+        base_url,
+        [anchor.get("href") for anchor in soup.find_all("a") if anchor.get("href")],
+    )
+    return title, content, links
+
+
+def save_corpus(urls_file, pages_dir):
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    urls = [line.strip() for line in open(urls_file) if line.strip()]
+    for idx, url in enumerate(urls):
+        page_source = get_static_html(fetch_static_page(url))
+        if page_source is None:
+            print(f"Could not download {url}")
+            continue
+        page_path = pages_dir / f"page_{idx:04d}.html"
+        # The first line keeps the url so that links can be resolved when benchmarking
+        page_path.write_text(f"<!-- {url} -->\n{page_source}", encoding="utf-8")
+        print(f"Saved {url} to {page_path}")
+
+
+def load_corpus(pages_dir):
+    corpus = []
+    for page_path in sorted(pages_dir.glob("*.html")):
+        page_source = page_path.read_text(encoding="utf-8", errors="replace")
+        first_line = page_source.split("\n", 1)[0]
+        base_url = ""
+        if first_line.startswith("<!-- ") and first_line.endswith(" -->"):
+            base_url = first_line[5:-4]
+        corpus.append((page_path.name, base_url, page_source))
+    return corpus
+
+
+def time_extractor(extract_func, page_source, base_url, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = extract_func(page_source, base_url)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def run_benchmark(corpus, repeat):
+    extractors = {"bs4 html.parser": extract_page_bs4}
+    if extraction.etree is not None:
+        extractors["single pass (lxml)"] = extraction.extract_page
+    extractors["single pass (stdlib)"] = lambda page_source, base_url: (
+        extraction.extract_page(page_source, base_url, use_lxml=False)
+    )
+
+    totals = {name: 0.0 for name in extractors}
+    print(f"{'page':<24}{'KB':>8}" + "".join(f"{name:>24}" for name in extractors))
+    for page_name, base_url, page_source in corpus:
+        row = f"{page_name:<24}{len(page_source) / 1024:>8.0f}"
+        results = dict()
+        for name, extract_func in extractors.items():
+            elapsed, results[name] = time_extractor(
+                extract_func, page_source, base_url, repeat
+            )
+            totals[name] += elapsed
+            row += f"{elapsed * 1000:>21.2f} ms"
+        print(row)
+        reference_links = set(results["bs4 html.parser"][2])
+        for name, (_, _, links) in results.items():
+            missing = reference_links - set(links)
+            if name != "bs4 html.parser" and missing:
+                print(f"    {name} misses {len(missing)} links of the reference")
+
+    print(f"{'total':<32}" + "".join(f"{t * 1000:>21.2f} ms" for t in totals.values()))
+    reference_total = totals["bs4 html.parser"]
+    for name, total in totals.items():
+        if name != "bs4 html.parser" and total > 0:
+            print(f"{name}: {reference_total / total:.1f}x faster than bs4 html.parser")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the single pass HTML extraction against BeautifulSoup"
+    )
+    parser.add_argument(
+        "pages_dir", type=Path, help="Folder of saved .html pages used as corpus"
+    )
+    parser.add_argument(
+        "--save_urls",
+        type=str,
+        default=None,
+        help="File with one url per line, downloads these pages into pages_dir first",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs per page, default is 5"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.save_urls:
+        save_corpus(args.save_urls, args.pages_dir)
+    corpus = load_corpus(args.pages_dir)
+    if not corpus:
+        print(f"No .html page found in {args.pages_dir}")
+    else:
+        run_benchmark(corpus, args.repeat)
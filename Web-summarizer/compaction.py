@@ -0,0 +1,158 @@
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.tokens import count_tokens, split_to_tokens, truncate_to_tokens
+
+WORD_RE = re.compile(r"[a-zA-Z][a-zA-Z0-9'-]+")
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "your", "you", "our",
+    "are", "was", "were", "has", "have", "will", "can", "not", "all", "its",
+    "about", "home", "page", "more", "into", "their", "they", "them", "who",
+}  # fmt: skip
+# Share of the budget given to the homepage compared to a subpage
+HOME_PAGE_WEIGHT = 2.0
+# Lines shorter than this are nav items, buttons, etc. and only kept if there is room
+MIN_PARAGRAPH_WORDS = 4
+
+
+def compact_pages(pages, token_budget, model_name=None):
+    # pages: [{"label": ..., "title": ..., "content": ...}], the homepage first
+    pages = remove_boilerplate(pages)
+    needs = [
+        sum(
+            paragraph_cost(paragraph, model_name)
+            for paragraph in split_paragraphs(page)
+        )
+        for page in pages
+    ]
+    weights = [HOME_PAGE_WEIGHT] + [1.0] * (len(pages) - 1)
+    budgets = allocate_budgets(needs, weights, token_budget)
+    return [
+        {**page, "content": select_paragraphs(page, budget, model_name)}
+        for page, budget in zip(pages, budgets)
+    ]
+
+
+def remove_boilerplate(pages):
+    # Lines repeated on several pages (menus, footers, cookie banners) are only kept once, on
+    # the first page they appear on, and duplicated lines inside a page are dropped
+    line_page_counts = Counter()
+    for page in pages:
+        line_page_counts.update({line.strip() for line in split_paragraphs(page)})
+
+    seen_boilerplate = set()
+    compacted_pages = []
+    for page in pages:
+        seen_in_page = set()
+        kept_lines = []
+        for line in split_paragraphs(page):
+            line = line.strip()
+            if line in seen_in_page:
+                continue
+            seen_in_page.add(line)
+            if line_page_counts[line] > 1:
+                if line in seen_boilerplate:
+                    continue
+                seen_boilerplate.add(line)
+            kept_lines.append(line)
+        compacted_pages.append({**page, "content": "\n".join(kept_lines)})
+    return compacted_pages
+
+
+def allocate_budgets(needs, weights, token_budget):
+    # Weighted water-filling: pages that need less than their share give the rest back
+    budgets = [0] * len(needs)
+    pending = set(range(len(needs)))
+    remaining = token_budget
+    while pending and remaining > 0:
+        total_weight = sum(weights[i] for i in pending)
+        shares = {i: int(remaining * weights[i] / total_weight) for i in pending}
+        satisfied = {i for i in pending if needs[i] <= shares[i]}
+        if not satisfied:
+            for i in pending:
+                budgets[i] = shares[i]
+            break
+        for i in satisfied:
+            budgets[i] = needs[i]
+            remaining -= needs[i]
+        pending -= satisfied
+    return budgets
+
+
+def select_paragraphs(page, budget, model_name=None):
+    paragraphs = split_paragraphs(page)
+    costs = [paragraph_cost(paragraph, model_name) for paragraph in paragraphs]
+    if sum(costs) <= budget:
+        return page["content"]
+
+    keywords = extract_keywords(page.get("title") or "")
+    ranked = sorted(
+        range(len(paragraphs)),
+        key=lambda i: score_paragraph(paragraphs[i], i, len(paragraphs), keywords),
+        reverse=True,
+    )
+    selected = []
+    used = 0
+    for i in ranked:
+        if used + costs[i] <= budget:
+            selected.append(i)
+            used += costs[i]
+    if not selected and paragraphs:
+        # A single paragraph bigger than the whole budget is cut instead of dropped
+        return truncate_to_tokens(paragraphs[ranked[0]], budget, model_name)
+    # Keep the reading order of the page
+    return "\n".join(paragraphs[i] for i in sorted(selected))
+
+
+def paragraph_cost(paragraph, model_name=None):
+    # +1 for the newline joining it to the next paragraph
+    return count_tokens(paragraph, model_name) + 1
+
+
+def split_paragraphs(page):
+    return [line for line in page["content"].split("\n") if line.strip()]
+
+
+def extract_keywords(text):
+    return {word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS}
+
+
+def score_paragraph(paragraph, position, n_paragraphs, keywords):
+    words = WORD_RE.findall(paragraph.lower())
+    if not words:
+        return 0.0
+    # Longer, sentence-like paragraphs carry more information than short labels
+    length_score = min(len(words), 40) / 40
+    if len(words) < MIN_PARAGRAPH_WORDS:
+        length_score -= 1.0
+    keyword_score = len(set(words) & keywords) / len(keywords) if keywords else 0.0
+    # Content near the top of the page is usually the most important
+    position_score = 1.0 - position / max(n_paragraphs, 1)
+    return length_score + keyword_score + 0.5 * position_score
+
+
+def split_into_chunks(content, max_tokens, model_name=None):
+    # Groups consecutive paragraphs into chunks of at most max_tokens tokens
+    chunks = []
+    current, used = [], 0
+    for paragraph in split_paragraphs({"content": content}):
+        # A paragraph bigger than a chunk is split over several chunks, not cut
+        pieces = [paragraph]
+        if paragraph_cost(paragraph, model_name) > max_tokens:
+            pieces = split_to_tokens(paragraph, max_tokens - 1, model_name)
+        for piece in pieces:
+            cost = paragraph_cost(piece, model_name)
+            if current and used + cost > max_tokens:
+                chunks.append("\n".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += cost
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
@@ -0,0 +1,106 @@
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
+
+
+def create_chrome_driver():
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    return webdriver.Chrome(options=options)
+
+
+class DriverPool:
+    def __init__(
+        self,
+        max_size=4,
+        max_pages_per_driver=50,
+        driver_factory=create_chrome_driver,
+    ):
+        self.max_size = max_size
+        self.max_pages_per_driver = max_pages_per_driver
+        self.driver_factory = driver_factory
+        # LIFO so the most recently used (warmest) driver is handed out first
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    @contextmanager
+    def driver(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No browser available after {timeout} seconds")
+        try:
+            driver, n_pages = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        healthy = True
+        try:
+            yield driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self._checkin(driver, n_pages + 1, healthy)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                driver, n_pages = self._idle.get_nowait()
+            except queue.Empty:
+                return self.driver_factory(), 0
+            if self.is_healthy(driver):
+                return driver, n_pages
+            self._quit(driver)
+
+    def _checkin(self, driver, n_pages, healthy):
+        # Recycle drivers after some pages to bound the memory growth of long-lived browsers
+        if self._closed or not healthy or n_pages >= self.max_pages_per_driver:
+            self._quit(driver)
+            return
+        self._idle.put((driver, n_pages))
+
+    def is_healthy(self, driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+
+_driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+
+def get_driver_pool(max_size=4, max_pages_per_driver=50):
+    # Process-wide pool shared by every WebsiteSummarizer
+    global _driver_pool
+    with _driver_pool_lock:
+        if _driver_pool is None:
+            _driver_pool = DriverPool(
+                max_size=max_size, max_pages_per_driver=max_pages_per_driver
+            )
+            atexit.register(_driver_pool.close)
+    return _driver_pool
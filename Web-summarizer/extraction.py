@@ -0,0 +1,123 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Elements whose text is never shown to a visitor
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe"}
+
+
+class PageExtractor:
+    # Collects the title, visible text and absolute links in a single walk over the
+    # parser events, instead of building a tree and walking it several times
+    def __init__(self, base_url=""):
+        self.base_url = base_url
+        self.title_parts = []
+        self.text_parts = []
+        self.links = []
+        self._buffer = []
+        self._skip_depth = 0
+        self._in_head = False
+        self._in_title = False
+        self._title_done = False
+
+    def start(self, tag, attrs):
+        self._flush()
+        tag = tag.lower()
+        if tag == "title":
+            # Only the document title, not a later <title> or the one of an <svg> icon
+            self._in_title = not (self._skip_depth or self._title_done)
+        elif tag == "head":
+            self._in_head = True
+        elif tag == "body":
+            # Sloppy pages do not always close their <head>
+            self._skip_depth = 0
+            self._in_head = False
+            self._in_title = False
+        elif tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "base" and attrs.get("href"):
+            self.base_url = urljoin(self.base_url, attrs["href"])
+        elif tag == "a" and attrs.get("href"):
+            self.links.append(attrs["href"])
+
+    def end(self, tag):
+        self._flush()
+        tag = tag.lower()
+        if tag == "title":
+            if self._in_title:
+                self._title_done = True
+            self._in_title = False
+        elif tag == "head":
+            self._in_head = False
+        elif tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def data(self, data):
+        self._buffer.append(data)
+
+    def close(self):
+        self._flush()
+        title = " ".join(self.title_parts) or None
+        return (
+            title,
+            "\n".join(self.text_parts),
+            resolve_links(self.base_url, self.links),
+        )
+
+    def _flush(self):
+        # Text split by entities or parser buffering is joined before being stripped
+        if not self._buffer:
+            return
+        text = "".join(self._buffer).strip()
+        self._buffer = []
+        if not text:
+            return
+        if self._in_title:
+            self.title_parts.append(text)
+        elif not (self._skip_depth or self._in_head):
+            self.text_parts.append(text)
+
+
+def resolve_links(base_url, hrefs):
+    # Absolute urls without fragment, in-page anchors and non-web links are dropped
+    links = []
+    for href in hrefs:
+        href = href.strip()
+        if href.startswith(("mailto:", "tel:", "javascript:", "#")):
+            continue
+        links.append(urldefrag(urljoin(base_url, href))[0])
+    return links
+
+
+class _StdlibPageParser(HTMLParser):
+    def __init__(self, extractor):
+        super().__init__(convert_charrefs=True)
+        self.extractor = extractor
+
+    def handle_starttag(self, tag, attrs):
+        self.extractor.start(tag, {key: value for key, value in attrs})
+
+    def handle_endtag(self, tag):
+        self.extractor.end(tag)
+
+    def handle_data(self, data):
+        self.extractor.data(data)
+
+
+def extract_page(page_source, base_url="", use_lxml=True):
+    extractor = PageExtractor(base_url)
+    if not page_source:
+        return extractor.close()
+    if use_lxml and etree is not None:
+        # lxml drives the same callbacks from C, without building a tree
+        parser = etree.HTMLParser(target=extractor)
+        parser.feed(page_source)
+        return parser.close()
+    parser = _StdlibPageParser(extractor)
+    parser.feed(page_source)
+    parser.close()
+    return extractor.close()
@@ -0,0 +1,91 @@
+import re
+import codecs
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+# Below this much visible text a page is considered to be rendered by JavaScript
+MIN_VISIBLE_TEXT_CHARS = 300
+# Empty mount points of client-side rendered apps
+JS_SHELL_MARKERS = (
+    'id="root"></div>',
+    'id="app"></div>',
+    'id="__next"></div>',
+    'id="__nuxt"></div>',
+)
+SCRIPT_STYLE_RE = re.compile(
+    r"<(script|style|noscript|template)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+TAG_RE = re.compile(r"<[^>]+>")
+WHITESPACE_RE = re.compile(r"\s+")
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session(pool_size=16):
+    # One keep-alive session shared by every scrape, requests pools the connections per host
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers.update({"User-Agent": USER_AGENT})
+    return _session
+
+
+def fetch_static_page(url, timeout=10, etag=None, last_modified=None):
+    # Conditional request when validators from a previous fetch are known
+    headers = dict()
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        return get_http_session().get(url, timeout=timeout, headers=headers)
+    except requests.RequestException as e:
+        print(f"Plain HTTP fetch of {url} failed: {e}")
+        return None
+
+
+def get_static_html(response):
+    if response is None or response.status_code != 200:
+        return None
+    if "html" not in response.headers.get("Content-Type", "").lower():
+        return None
+    # Without a charset in the header requests falls back to ISO-8859-1, the page's
+    # own meta charset (or the detected encoding) is used instead, as browsers do
+    if "charset" not in response.headers.get("Content-Type", "").lower():
+        response.encoding = get_meta_charset(response.content) or (
+            response.apparent_encoding
+        )
+    return response.text
+
+
+def get_meta_charset(content):
+    match = META_CHARSET_RE.search(content[:4096])
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode("ascii")).name
+    except LookupError:
+        return None
+
+
+def looks_like_js_shell(html):
+    lowered = html.lower()
+    if "<body" not in lowered:
+        return True
+    if any(marker in lowered for marker in JS_SHELL_MARKERS):
+        return True
+    visible_text = TAG_RE.sub(" ", SCRIPT_STYLE_RE.sub(" ", html))
+    visible_text = WHITESPACE_RE.sub(" ", visible_text).strip()
+    return len(visible_text) < MIN_VISIBLE_TEXT_CHARS
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+from base.cache import DEFAULT_CACHE_DIR
+
+TRACKING_PARAM_PREFIXES = ("utm_", "fbclid", "gclid", "mc_")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+        )
+    )
+    # The fragment never reaches the server, so it is dropped
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def hash_content(page_source):
+    return hashlib.sha256(page_source.encode("utf-8", errors="replace")).hexdigest()
+
+
+class PageCache:
+    def __init__(self, path=DEFAULT_CACHE_DIR / "pages.sqlite3", ttl=12 * 3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, title TEXT, content TEXT NOT NULL, links TEXT NOT NULL, "
+                "content_hash TEXT NOT NULL, etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, content, links, content_hash, etag, last_modified, fetched_at "
+                "FROM pages WHERE url = ?",
+                (normalize_url(url),),
+            ).fetchone()
+        if row is None:
+            return None
+        title, content, links, content_hash, etag, last_modified, fetched_at = row
+        return {
+            "title": title,
+            "content": content,
+            "links": json.loads(links),
+            "content_hash": content_hash,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": fetched_at,
+        }
+
+    def is_fresh(self, page):
+        return time.time() - page["fetched_at"] < self.ttl
+
+    def set(
+        self, url, title, content, links, content_hash, etag=None, last_modified=None
+    ):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, title, content, links, content_hash, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    normalize_url(url),
+                    str(title) if title is not None else None,
+                    content,
+                    json.dumps(links),
+                    content_hash,
+                    etag,
+                    last_modified,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def touch(self, url):
+        # The server confirmed the page did not change, restart its TTL
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ? WHERE url = ?",
+                (time.time(), normalize_url(url)),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache()
+    return _page_cache
@@ -6,30 +6,27 @@ import argparse
 import time
 from pathlib import Path
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, render_template, Response
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 from base.base_class import BasePromptGenerator
+from base.cache import get_default_cache, make_cache_key
+from base.prompts import render_prompt, static_prompt
 from base.utils import get_stream
+from driver_pool import get_driver_pool
+from fetcher import fetch_static_page, get_static_html, looks_like_js_shell
+from page_cache import get_page_cache, hash_content
+from extraction import extract_page
+from compaction import compact_pages, remove_boilerplate, split_into_chunks
 
-
-class WebsiteSummarizer(BasePromptGenerator):
-    def __init__(self, url, model_name="gpt-4o-mini", api_key=None):
-        super().__init__(model_name=model_name, api_key=api_key)
-        self.url = url
-        self.title = "No title found"
-        self.content = "No content found"
-        self.links = ["No link found"]
-        self.all_website_details = "No information available"
-        self.system_prompt = "You are an assistant whose job is to summarize the content of a website. \
+SYSTEM_PROMPT = static_prompt(
+    "You are an assistant whose job is to summarize the content of a website. \
             What you will do is to analyze the content of the given website then to give an informative \
             summary about it. Here are some example questions/ that you should response to, any additional \
             question is welcome, giving example for what is talked about is recommended: \n\
@@ -42,8 +39,8 @@ class WebsiteSummarizer(BasePromptGenerator):
                  (such as what they are, in which forms they are provided, what the pricing is, etc.)? \n\
             6. Does it contain announcement or news? If yes, analyze and summarize it.\n\
             You should response in markdown."
-        self.system_prompt = re.sub(r"\t+| {2,}", " ", self.system_prompt)
-        self.relevant_links_system_prompt = """
+)
+RELEVANT_LINKS_SYSTEM_PROMPT = static_prompt("""
             You are an assistant who is provided with a list of links found on a website \
                 and is able to decide which links are the most relevant \
                 to include in a summary of that website, such as links to \
@@ -55,53 +52,149 @@ class WebsiteSummarizer(BasePromptGenerator):
                     {"type": "Careers page", "url": "https://www.another.full.url/careers"}
                 ]
             }
-        """
-        self.relevant_links_system_prompt = re.sub(
-            r"\t+| {2,}", " ", self.relevant_links_system_prompt
-        )
+        """)
+MAP_SYSTEM_PROMPT = static_prompt("""
+            You are an assistant who summarizes one page (or one part of a page) of a website, \
+                the summary will be merged later with the summaries of the other pages.
+            Keep every concrete and useful information: what the company/organization/person does, \
+                products, services, pricing, people, figures, announcements and news.
+            Skip navigation, legal and cookie texts. Respond with concise markdown bullet points.
+        """)
+# Static instructions first, the website specific content last, so that requests for
+# different websites share the same prefix
+USER_PROMPT_TEMPLATE = static_prompt("""
+    Please use the contents of the homepage and other relevant pages of the website \
+        below to make an informative and detailed summary of the website in markdown.
+    Website to analyze and summarize: {url}
+    Title: {title}
+    Contents:
+    """)
+RELEVANT_LINKS_USER_PROMPT_TEMPLATE = static_prompt("""
+    Below is the list of the links found on a website, please decide which of the links \
+        are relevant for making the summary of the website. Please response with full \
+        HTTPS URL in JSON format. Do not include Terms of Service, Policies, Privacy and \
+        emails links.
+    Website: {url}
+    Links (some might be relative links):
+    """)
+
+
+class WebsiteSummarizer(BasePromptGenerator):
+    def __init__(
+        self,
+        url,
+        model_name="gpt-4o-mini",
+        api_key=None,
+        cache=None,
+        driver_pool=None,
+        max_concurrent_pages=4,
+        page_timeout=30,
+        page_cache=None,
+        token_budget=6000,
+        map_reduce=False,
+        map_chunk_tokens=3000,
+        screenshot=True,
+    ):
+        super().__init__(model_name=model_name, api_key=api_key, cache=cache)
+        self.url = url
+        self.driver_pool = driver_pool if driver_pool is not None else get_driver_pool()
+        self.max_concurrent_pages = max_concurrent_pages
+        self.page_timeout = page_timeout
+        self.page_cache = page_cache if page_cache is not None else get_page_cache()
+        self.token_budget = token_budget
+        self.map_reduce = map_reduce
+        self.map_chunk_tokens = map_chunk_tokens
+        # Headless batch runs skip the homepage screenshot shown by the Flask page
+        self.screenshot = screenshot
+        # Page summaries of the map step are always cached, keyed on the page content
+        self.map_cache = cache if cache is not None else get_default_cache()
+        self.title = "No title found"
+        self.content = "No content found"
+        self.links = ["No link found"]
+        self.all_website_details = "No information available"
+        self.system_prompt = SYSTEM_PROMPT
+        self.relevant_links_system_prompt = RELEVANT_LINKS_SYSTEM_PROMPT
+        self.map_system_prompt = MAP_SYSTEM_PROMPT
         # self.get_main_information()
 
     def get_main_information(self):
         self.title, self.content, self.links = self.scrape_website(
-            self.url, screenshot=True
+            self.url, screenshot=self.screenshot
         )
 
     def scrape_website(self, url, screenshot=False):
-        # Selenium
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        driver = webdriver.Chrome(options=options)
-        driver.get(url)
-
-        if screenshot:
-            time.sleep(1)  # Wait for the page to load
-            # Take a screenshot of the website
-            screenshot_dir = FILE.parent / "static"
-            if not os.path.exists(screenshot_dir):
-                print("Creating 'static' folder for website screenshot")
-                os.makedirs(screenshot_dir)
-            screenshot_path = os.path.join(screenshot_dir, "website_screenshot.png")
-            driver.save_screenshot(screenshot_path)
-
-        page_source = driver.page_source
-        driver.quit()
-
-        soup = BeautifulSoup(page_source, "html.parser")
-        if soup.title:
-            title = soup.title.string
-        if soup.body:
-            for irrelevant in soup.body(["script", "type", "img", "input"]):
-                irrelevant.decompose()
-            content = soup.get_text(separator="\n", strip=True)
+        cached_page = self.page_cache.get(url)
+        cached_result = None
+        if cached_page is not None:
+            cached_result = (
+                cached_page["title"],
+                cached_page["content"],
+                cached_page["links"],
+            )
+            if not screenshot and self.page_cache.is_fresh(cached_page):
+                return cached_result
+
+        page_source = None
+        etag, last_modified = None, None
+        if not screenshot:
+            # Server-rendered pages only need a plain HTTP request
+            response = fetch_static_page(
+                url,
+                timeout=self.page_timeout,
+                etag=cached_page["etag"] if cached_page else None,
+                last_modified=cached_page["last_modified"] if cached_page else None,
+            )
+            if cached_result is not None and response is not None:
+                if response.status_code == 304:
+                    print(f"{url} not modified, using the cached page")
+                    self.page_cache.touch(url)
+                    return cached_result
+            page_source = get_static_html(response)
+            if page_source is not None:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                if looks_like_js_shell(page_source):
+                    print(f"{url} needs JavaScript rendering, using the browser")
+                    page_source = None
+        if page_source is None:
+            page_source = self.render_website(url, screenshot=screenshot)
+
+        # Identical HTML does not need to be parsed again
+        content_hash = hash_content(page_source)
+        if cached_result is not None and cached_page["content_hash"] == content_hash:
+            title, content, links = cached_result
         else:
-            content = ""
-        links = [
-            anchor.get("href") for anchor in soup.find_all("a") if anchor.get("href")
-        ]
+            title, content, links = self.parse_page(page_source, url)
+        self.page_cache.set(
+            url, title, content, links, content_hash, etag, last_modified
+        )
         return title, content, links
 
+    def parse_page(self, page_source, url):
+        # Single pass over the HTML, links come back as absolute urls
+        return extract_page(page_source, base_url=url)
+
+    def render_website(self, url, screenshot=False):
+        # Selenium, with a browser borrowed from the shared pool
+        # Waiting for a free browser counts against the page timeout too, a subpage
+        # that cannot get one in time is skipped
+        with self.driver_pool.driver(timeout=self.page_timeout) as driver:
+            driver.set_page_load_timeout(self.page_timeout)
+            driver.get(url)
+
+            if screenshot:
+                time.sleep(1)  # Wait for the page to load
+                # Take a screenshot of the website
+                screenshot_dir = FILE.parent / "static"
+                if not os.path.exists(screenshot_dir):
+                    print("Creating 'static' folder for website screenshot")
+                    os.makedirs(screenshot_dir)
+                screenshot_path = os.path.join(screenshot_dir, "website_screenshot.png")
+                driver.save_screenshot(screenshot_path)
+
+            page_source = driver.page_source
+        return page_source
+
     def get_content(self, title, content):
         content = f"""
             Website title: {title},
@@ -111,18 +204,7 @@ class WebsiteSummarizer(BasePromptGenerator):
 
     def get_relevant_links_user_prompt(self):
         links = "\n".join(self.links)
-        relevant_links_user_prompt = f"""
-            Below is the list of the links found on the website of {self.url}, \
-            please decide which of the links are relevant for making the summary \
-            of the website. Please response with full HTTPS URL in JSON format. \
-            Do not include Terms of Service, Policies, Privacy and emails links.
-            Links (some might be relative links):
-        """
-        relevant_links_user_prompt = re.sub(
-            r"\t+| {2,}", " ", relevant_links_user_prompt
-        )
-        relevant_links_user_prompt += links
-        return relevant_links_user_prompt
+        return render_prompt(RELEVANT_LINKS_USER_PROMPT_TEMPLATE, url=self.url) + links
 
     def build_relevant_links(self):
         message = self.create_message(
@@ -134,33 +216,141 @@ class WebsiteSummarizer(BasePromptGenerator):
         return json.loads(response)
 
     def get_all_website_details(self):
-        all_website_details = "Home page:"
+        pages = self.get_all_pages()
+        # Fit every page into the prompt budget instead of sending the raw text
+        if self.token_budget is not None:
+            pages = compact_pages(pages, self.token_budget, self.model_name)
+        all_website_details = ""
+        for page in pages:
+            all_website_details += f"{page['label']}:"
+            all_website_details += self.get_content(page["title"], page["content"])
+        return all_website_details
+
+    def get_all_pages(self):
         self.get_main_information()
-        all_website_details += self.get_content(self.title, self.content)
+        pages = [
+            {
+                "label": "Home page",
+                "url": self.url,
+                "title": self.title,
+                "content": self.content,
+            }
+        ]
         dict_relevant_links = self.build_relevant_links()
-        for subpage_info in dict_relevant_links["links"]:
-            print(f"Reading {subpage_info['type']} with url: {subpage_info['url']}")
-            all_website_details += f"{subpage_info['type']}:"
-            title, content, _ = self.scrape_website(subpage_info["url"])
-            all_website_details += self.get_content(title, content)
-        return all_website_details
+        subpages = dict_relevant_links["links"]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_pages) as executor:
+            futures = [
+                executor.submit(self.scrape_subpage, subpage_info)
+                for subpage_info in subpages
+            ]
+            # Results are assembled in link order, whatever order the pages finish in
+            for subpage_info, future in zip(subpages, futures):
+                scraped = future.result()
+                if scraped is None:
+                    continue
+                title, content, _ = scraped
+                pages.append(
+                    {
+                        "label": subpage_info["type"],
+                        "url": subpage_info["url"],
+                        "title": title,
+                        "content": content,
+                    }
+                )
+        return pages
+
+    def scrape_subpage(self, subpage_info):
+        print(f"Reading {subpage_info['type']} with url: {subpage_info['url']}")
+        try:
+            return self.scrape_website(subpage_info["url"])
+        except Exception as e:
+            # A slow or broken subpage should not sink the whole summary
+            print(f"Skipping {subpage_info['url']}: {e}")
+            return None
 
     def get_user_prompt(self):
-        user_prompt = f"""
-        Here is the website that you need to analyze and summarize: {self.url}. \
-        Its title is {self.title}. 
-        Its contents of its homepage and other relevant pages are as following, \
-            please use them to make an informative and detailed summary of the website \
-            in markdown:
-        {self.all_website_details}
-        """
-        return user_prompt
+        return (
+            render_prompt(USER_PROMPT_TEMPLATE, url=self.url, title=self.title)
+            + self.all_website_details
+        )
 
     def get_summary(self, stream=False):
+        if self.map_reduce:
+            return self.get_map_reduce_summary(stream=stream)
         self.all_website_details = self.get_all_website_details()
         message = self.create_message(self.system_prompt, self.get_user_prompt())
         return self.inference(self.model_name, message, stream=stream)
 
+    def get_map_reduce_summary(self, stream=False):
+        # Map: every page (or chunk of a large page) is summarized concurrently,
+        # reduce: the partial summaries are merged by one final call
+        # The map step only sees the page's own content, the cross-page deduplication
+        # and the link labels chosen by the model come after it, so a page summary
+        # stays cached as long as that page does not change
+        map_units = []
+        for page in self.get_all_pages():
+            chunks = split_into_chunks(
+                page["content"], self.map_chunk_tokens, self.model_name
+            )
+            for idx, chunk in enumerate(chunks):
+                label = page["label"]
+                if len(chunks) > 1:
+                    label += f" (part {idx + 1}/{len(chunks)})"
+                map_units.append(
+                    {
+                        "label": label,
+                        "url": page["url"],
+                        "title": page["title"],
+                        "content": chunk,
+                    }
+                )
+        partial_summaries = asyncio.run(self.asummarize_pages(map_units))
+        summary_pages = remove_boilerplate(
+            [
+                {**unit, "content": partial_summary or ""}
+                for unit, partial_summary in zip(map_units, partial_summaries)
+            ]
+        )
+
+        self.all_website_details = ""
+        for page in summary_pages:
+            self.all_website_details += (
+                f"{page['label']} summary:\n{page['content']}\n\n"
+            )
+        message = self.create_message(self.system_prompt, self.get_user_prompt())
+        return self.inference(self.model_name, message, stream=stream)
+
+    async def asummarize_pages(self, pages):
+        return await asyncio.gather(*[self.asummarize_page(page) for page in pages])
+
+    def get_map_cache_key(self, model_name, url, page_content):
+        return make_cache_key(
+            model_name, [self.map_system_prompt, url, hash_content(page_content)]
+        )
+
+    async def asummarize_page(self, page):
+        page_content = self.get_content(page["title"], page["content"])
+        message = self.create_message(
+            self.map_system_prompt, f"Page {page['url']}\n" + page_content
+        )
+        # A page whose content did not change since the last run reuses its summary,
+        # whatever happened to the other pages. Like the response cache, it is looked up
+        # under the model the router would pick and stored under the model that answered
+        routes = self.get_routes(self.model_name, message)
+        page_summary = self.map_cache.get(
+            self.get_map_cache_key(routes[0][1], page["url"], page_content)
+        )
+        if page_summary is None:
+            print(f"Summarizing {page['label']}")
+            page_summary, model_name = await self.acomplete(routes, message)
+            # No content (e.g. a refusal) is not cached, the page is summarized again
+            if page_summary is not None:
+                self.map_cache.set(
+                    self.get_map_cache_key(model_name, page["url"], page_content),
+                    page_summary,
+                )
+        return page_summary
+
 
 class RenderWebsiteAndSummary:
     def __init__(self, url, summary_response_from_model):
@@ -188,14 +378,40 @@ def parse_arguments():
         default=None,
         help="API key for Ollama models, i.e. 'ollama', default is None to use your own API Key",
     )
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=6000,
+        help="Maximum number of tokens of website content put in the summary prompt, default is 6000",
+    )
+    parser.add_argument(
+        "--map_reduce",
+        action="store_true",
+        help="Summarize every page concurrently then merge the page summaries, for very large websites",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        help="Cache model responses in memory and on disk so repeated prompts skip the API call",
+    )
 
     args = parser.parse_args()
     return args
 
 
-def main(url, model_name, api_key):
+def main(
+    url, model_name, api_key, token_budget=6000, map_reduce=False, use_cache=False
+):
     # Scrape the website and generate a summary
-    web_summarizer = WebsiteSummarizer(url, model_name, api_key)
+    cache = get_default_cache() if use_cache else None
+    web_summarizer = WebsiteSummarizer(
+        url,
+        model_name,
+        api_key,
+        cache=cache,
+        token_budget=token_budget,
+        map_reduce=map_reduce,
+    )
     summary = web_summarizer.get_summary(stream=True)
 
     # Convert Markdown to HTML
@@ -1,42 +1,154 @@
 import os
-import subprocess
+import time
+import asyncio
+import functools
+import threading
+import weakref
 
-import ollama
-from openai import OpenAI
+from openai import (
+    NOT_GIVEN,
+    OpenAI,
+    AsyncOpenAI,
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+)
 from dotenv import load_dotenv
 
+from base.cache import make_cache_key, replay_stream, record_stream
+from base.ollama_manager import get_ollama_manager
+from base.prompts import usage_tracker
+
+# Errors of a backend (unreachable, timed out, overloaded) after which a routed request
+# is retried on the next backend
+FAILOVER_ERRORS = (APIConnectionError, InternalServerError, RateLimitError, OSError)
+
+
+@functools.lru_cache(maxsize=None)
+def load_environment():
+    # .env is read once per process, not for every tool instance
+    load_dotenv()
+
 
 class BasePromptGenerator:
-    def __init__(self, model_name, api_key=None):
+    # Async clients and semaphores are bound to an event loop, so they are shared
+    # per (loop, backend) across every instance instead of per instance
+    _async_state = weakref.WeakKeyDictionary()
+    _async_state_lock = threading.Lock()
+    # Sync clients are thread-safe and keep a connection pool, one per backend is
+    # shared by every instance
+    _clients = dict()
+    _clients_lock = threading.Lock()
+
+    def __init__(
+        self, model_name, api_key=None, cache=None, max_concurrency=8, router=None
+    ):
         self.infer_locally = False
-        if api_key == "ollama":
-            print(f"Using local model for inference with api_key = {api_key}")
-            subprocess.Popen(
-                ["ollama", "serve"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        self.base_url = None
+        self.client_api_key = None
+        self.router = router
+        if router is not None:
+            # The backend (and with the 'auto' model name, the model) is picked for
+            # every request, see base.router
+            print(
+                f"Routing requests between {', '.join(router.backends)} "
+                f"with the {router.policy} policy"
             )
+            self.openai = None
+            local_models = [
+                backend.models[0]
+                for backend in router.backends.values()
+                if backend.local and backend.models
+            ]
+            get_ollama_manager().warm_up_in_background(local_models)
+        elif api_key == "ollama":
+            print(f"Using local model for inference with api_key = {api_key}")
+            # Started (or found running), pulled and loaded once per process, without
+            # blocking the tool
+            ollama_manager = get_ollama_manager()
+            ollama_manager.warm_up_in_background([model_name])
             try:
-                self.openai = OpenAI(
-                    base_url="http://localhost:11434/v1", api_key=api_key
-                )
+                self.openai = self.get_client(ollama_manager.base_url, api_key)
+                self.base_url = ollama_manager.base_url
+                self.client_api_key = api_key
                 self.infer_locally = True
             except:
                 print(
-                    "Ollama may not be running, use 'ollama serve' command to run it from your anaconda prompt, \
-                        and check http://localhost:11434"
+                    f"Ollama may not be running, use 'ollama serve' command to run it from your anaconda prompt, \
+                        and check {ollama_manager.host}"
                 )
                 exit(0)
         else:
-            load_dotenv()
+            load_environment()
             api_key = os.getenv("OPENAI_API_KEY")
             if (not api_key) or (not api_key.startswith("sk-proj")):
                 print(f"Problem with OpenAI API Key, please check it, key = {api_key}")
                 exit(0)
             print(f"Using cloud model with api_key = {api_key}")
-            self.openai = OpenAI()
+            self.openai = self.get_client(None, None)
 
         self.model_name = model_name
+        self.cache = cache
+        self.max_concurrency = max_concurrency
         self.system_prompt = "System prompt goes here"
 
+    @classmethod
+    def get_client(cls, base_url, api_key):
+        backend = (base_url, api_key)
+        with cls._clients_lock:
+            if backend not in cls._clients:
+                if base_url is None:
+                    cls._clients[backend] = OpenAI()
+                else:
+                    cls._clients[backend] = OpenAI(base_url=base_url, api_key=api_key)
+            return cls._clients[backend]
+
+    def warm_up(self):
+        # Pulls the model if needed and opens a connection before the first request
+        for backend, model_name in self.get_routes(self.model_name, None):
+            if self.is_local(backend):
+                get_ollama_manager().warm_up(model_name)
+                continue
+            try:
+                self.get_backend_client(backend).models.list()
+            except Exception as e:
+                print(f"Could not warm up {model_name}: {e}")
+
+    def is_ready(self):
+        # Cloud models are always ready, local ones once pulled and loaded
+        backend, model_name = self.get_routes(self.model_name, None)[0]
+        return not self.is_local(backend) or get_ollama_manager().is_ready(model_name)
+
+    def get_routes(self, model_name, message):
+        # (backend, model) pairs to try in order, without a router the only backend is
+        # the one of the instance
+        if self.router is None:
+            return [(None, model_name)]
+        return self.router.route(message, model_name)
+
+    def is_local(self, backend):
+        return self.infer_locally if backend is None else backend.local
+
+    def get_backend_client(self, backend):
+        if backend is None:
+            return self.openai
+        client = self.get_client(backend.base_url, backend.api_key)
+        # Failing over to the next backend replaces the retries of the client
+        return client.with_options(timeout=backend.timeout, max_retries=0)
+
+    def on_backend_error(self, backend, model_name, error):
+        if backend is None:
+            raise error
+        self.router.record(backend, error=True)
+        print(
+            f"{model_name} on {backend.name} failed with {type(error).__name__}, "
+            "trying the next backend"
+        )
+
+    def on_backend_success(self, backend, start):
+        if backend is not None:
+            self.router.record(backend, latency=time.perf_counter() - start)
+
     def get_user_prompt(self, text):
         user_prompt = f"User prompt goes here with following text: {text}"
         return user_prompt
@@ -47,20 +159,205 @@ class BasePromptGenerator:
             {"role": "user", "content": user_prompt},
         ]
 
-    def inference(self, model_name, message, stream=False, response_format=None):
+    def ensure_model_available(self, model_name, infer_locally=None):
+        if infer_locally is None:
+            infer_locally = self.infer_locally
+        if infer_locally:
+            get_ollama_manager().ensure_model(model_name)
+
+    def inference(
+        self, model_name, message, stream=False, response_format=None, use_cache=True
+    ):
         print(f"Inference with model {model_name}")
-        if self.infer_locally and (not model_name in ollama.list()["models"]):
-            print(
-                f"{model_name} not exists locally, start pulling it from ollama library..."
-            )
-            subprocess.run(["ollama", "pull", model_name])
+        routes = self.get_routes(model_name, message)
+        use_cache = self.cache is not None and use_cache
+        if use_cache:
+            cached_response = self.get_cached_response(routes, message, response_format)
+            if cached_response is not None:
+                return replay_stream(cached_response) if stream else cached_response
+
+        if not stream:
+            content, model_name = self.complete(routes, message, response_format)
+            if use_cache and content is not None:
+                self.cache.set(
+                    make_cache_key(model_name, message, response_format), content
+                )
+            return content
 
-        response = self.openai.chat.completions.create(
-            model=model_name,
-            messages=message,
-            stream=stream,
-            response_format=response_format,
+        response, model_name = self.create_completion(
+            routes, message, stream, response_format
         )
-        if stream:
+        response = self.track_stream_usage(model_name, response)
+        if not use_cache:
             return response
-        return response.choices[0].message.content
+        cache_key = make_cache_key(model_name, message, response_format)
+        return record_stream(response, lambda text: self.cache.set(cache_key, text))
+
+    def complete(self, routes, message, response_format=None):
+        # The answer and the model that gave it, for callers caching it themselves
+        response, model_name = self.create_completion(
+            routes, message, False, response_format
+        )
+        usage_tracker.record(model_name, response.usage)
+        return response.choices[0].message.content, model_name
+
+    def get_cached_response(self, routes, message, response_format):
+        # Answers are cached under the model that gave them, and looked up under the
+        # model the router would pick now, so with 'auto' a cheap model's answer is
+        # not served once the policy prefers another model
+        model_name = routes[0][1]
+        cached_response = self.cache.get(
+            make_cache_key(model_name, message, response_format)
+        )
+        if cached_response is not None:
+            print(f"Cache hit for model {model_name}")
+        return cached_response
+
+    def create_completion(self, routes, message, stream, response_format):
+        last_error = None
+        for backend, routed_model in routes:
+            start = time.perf_counter()
+            try:
+                self.ensure_model_available(routed_model, self.is_local(backend))
+                response = self.get_backend_client(backend).chat.completions.create(
+                    model=routed_model,
+                    messages=message,
+                    stream=stream,
+                    response_format=response_format,
+                    # The last chunk then carries the usage, with the cached prompt tokens
+                    stream_options={"include_usage": True} if stream else NOT_GIVEN,
+                )
+            except FAILOVER_ERRORS as e:
+                self.on_backend_error(backend, routed_model, e)
+                last_error = e
+                continue
+            self.on_backend_success(backend, start)
+            return response, routed_model
+        raise last_error
+
+    def track_stream_usage(self, model_name, response):
+        # The usage chunk has no choices, it is recorded and not passed to the callers
+        for chunk in response:
+            if chunk.usage is not None:
+                usage_tracker.record(model_name, chunk.usage)
+            if chunk.choices:
+                yield chunk
+
+    def _get_async_resources(self, backend=None):
+        loop = asyncio.get_running_loop()
+        if backend is None:
+            base_url, api_key = self.base_url, self.client_api_key
+        else:
+            base_url, api_key = backend.base_url, backend.api_key
+        with self._async_state_lock:
+            loop_state = self._async_state.setdefault(loop, {})
+            if (base_url, api_key) not in loop_state:
+                if base_url is None:
+                    client = AsyncOpenAI()
+                else:
+                    client = AsyncOpenAI(base_url=base_url, api_key=api_key)
+                loop_state[(base_url, api_key)] = (
+                    client,
+                    asyncio.Semaphore(self.max_concurrency),
+                )
+            client, semaphore = loop_state[(base_url, api_key)]
+        if backend is not None:
+            client = client.with_options(timeout=backend.timeout, max_retries=0)
+        return client, semaphore
+
+    async def ainference(
+        self, model_name, message, stream=False, response_format=None, use_cache=True
+    ):
+        if stream:
+            return self.astream(model_name, message, response_format, use_cache)
+
+        print(f"Async inference with model {model_name}")
+        routes = self.get_routes(model_name, message)
+        use_cache = self.cache is not None and use_cache
+        if use_cache:
+            cached_response = self.get_cached_response(routes, message, response_format)
+            if cached_response is not None:
+                return cached_response
+
+        content, model_name = await self.acomplete(routes, message, response_format)
+        if use_cache and content is not None:
+            self.cache.set(
+                make_cache_key(model_name, message, response_format), content
+            )
+        return content
+
+    async def acomplete(self, routes, message, response_format=None):
+        last_error = None
+        for backend, routed_model in routes:
+            client, semaphore = self._get_async_resources(backend)
+            try:
+                await asyncio.to_thread(
+                    self.ensure_model_available, routed_model, self.is_local(backend)
+                )
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.chat.completions.create(
+                        model=routed_model,
+                        messages=message,
+                        response_format=response_format,
+                    )
+            except FAILOVER_ERRORS as e:
+                self.on_backend_error(backend, routed_model, e)
+                last_error = e
+                continue
+            self.on_backend_success(backend, start)
+            usage_tracker.record(routed_model, response.usage)
+            return response.choices[0].message.content, routed_model
+        raise last_error
+
+    async def astream(self, model_name, message, response_format=None, use_cache=True):
+        print(f"Async streaming inference with model {model_name}")
+        routes = self.get_routes(model_name, message)
+        use_cache = self.cache is not None and use_cache
+        if use_cache:
+            cached_response = self.get_cached_response(routes, message, response_format)
+            if cached_response is not None:
+                for chunk in replay_stream(cached_response):
+                    yield chunk
+                return
+
+        last_error = None
+        parts = []
+        for backend, routed_model in routes:
+            client, semaphore = self._get_async_resources(backend)
+            # The slot is held until the stream is exhausted, since the request is in
+            # flight, failing over is only possible before the first chunk
+            async with semaphore:
+                try:
+                    await asyncio.to_thread(
+                        self.ensure_model_available,
+                        routed_model,
+                        self.is_local(backend),
+                    )
+                    start = time.perf_counter()
+                    response = await client.chat.completions.create(
+                        model=routed_model,
+                        messages=message,
+                        stream=True,
+                        response_format=response_format,
+                        stream_options={"include_usage": True},
+                    )
+                except FAILOVER_ERRORS as e:
+                    self.on_backend_error(backend, routed_model, e)
+                    last_error = e
+                    continue
+                self.on_backend_success(backend, start)
+                async for chunk in response:
+                    if chunk.usage is not None:
+                        usage_tracker.record(routed_model, chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    parts.append(chunk.choices[0].delta.content or "")
+                    yield chunk
+            break
+        else:
+            raise last_error
+        if use_cache:
+            self.cache.set(
+                make_cache_key(routed_model, message, response_format), "".join(parts)
+            )
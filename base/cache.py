@@ -0,0 +1,211 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "llms-tools"
+
+
+def make_cache_key(model_name, messages, response_format=None):
+    # Canonical JSON so that dict ordering / whitespace never changes the key
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "messages": messages,
+            "response_format": response_format,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, created_at = item
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache:
+    # Expired rows are pruned and the least recently used rows evicted beyond max_rows,
+    # every prune_every writes so the file cannot grow without bound
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_DIR / "responses.sqlite3",
+        ttl=None,
+        max_rows=10_000,
+        prune_every=100,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Files written before the LRU eviction have no access time yet
+            columns = {
+                row[1] for row in self._conn.execute("PRAGMA table_info(responses)")
+            }
+            if "accessed_at" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE responses ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0"
+                )
+                self._conn.execute("UPDATE responses SET accessed_at = created_at")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+            self._prune()
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes >= self.prune_every:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        self._writes = 0
+        if self.ttl is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+        if self.max_rows is not None:
+            (n_rows,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if n_rows > self.max_rows:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (n_rows - self.max_rows,),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+class ResponseCache:
+    # Looks up tiers in order (fastest first) and backfills the faster tiers on a hit
+    def __init__(self, *tiers):
+        self.tiers = list(tiers)
+
+    def get(self, key):
+        for idx, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster_tier in self.tiers[:idx]:
+                    faster_tier.set(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache(max_size=1024, ttl=7 * 24 * 3600, disk_path=None):
+    # Process-wide memory + SQLite cache shared by every tool
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            disk_path = disk_path or DEFAULT_CACHE_DIR / "responses.sqlite3"
+            _default_cache = ResponseCache(
+                MemoryCache(max_size=max_size, ttl=ttl),
+                SQLiteCache(path=disk_path, ttl=ttl),
+            )
+    return _default_cache
+
+
+def replay_stream(text, chunk_size=32):
+    # Mimic OpenAI streaming chunks so callers can keep using chunk.choices[0].delta.content
+    for start in range(0, len(text), chunk_size):
+        delta = SimpleNamespace(content=text[start : start + chunk_size])
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)]
+        )
+
+
+def record_stream(stream, on_complete):
+    # Pass chunks through and hand the full text over only when the stream is exhausted
+    parts = []
+    for chunk in stream:
+        if chunk.choices:
+            parts.append(chunk.choices[0].delta.content or "")
+        yield chunk
+    on_complete("".join(parts))
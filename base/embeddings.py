@@ -0,0 +1,53 @@
+import functools
+import threading
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_encode_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_model(model_name=DEFAULT_EMBEDDING_MODEL):
+    if SentenceTransformer is None:
+        raise ImportError(
+            "Install sentence-transformers to use embeddings, see environment.yml"
+        )
+    print(f"Loading embedding model {model_name}")
+    return SentenceTransformer(model_name)
+
+
+def embed_texts(texts, model_name=DEFAULT_EMBEDDING_MODEL, batch_size=64):
+    # Unit-length float32 vectors, so that the inner product is the cosine similarity
+    model = get_embedding_model(model_name)
+    with _encode_lock:
+        vectors = model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def embed_documents(texts, model_name=DEFAULT_EMBEDDING_MODEL, chunk_words=200):
+    # Long documents (CVs, job descriptions) exceed what the embedding model reads,
+    # so every chunk is embedded in one batch and the chunks of a document averaged
+    chunks, owners = [], []
+    for idx, text in enumerate(texts):
+        words = text.split() or [""]
+        for start in range(0, len(words), chunk_words):
+            chunks.append(" ".join(words[start : start + chunk_words]))
+            owners.append(idx)
+    chunk_vectors = embed_texts(chunks, model_name)
+    vectors = np.zeros((len(texts), chunk_vectors.shape[1]), dtype=np.float32)
+    np.add.at(vectors, np.array(owners), chunk_vectors)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,207 @@
+import os
+import time
+import threading
+import subprocess
+from urllib.parse import urlsplit
+
+import ollama
+
+OLLAMA_HOST = "http://localhost:11434"
+OLLAMA_PORT = 11434
+# The installed-model list is read again after this long, in seconds, or when a pull
+# invalidates it
+MODELS_TTL = 60
+# How long Ollama keeps a warmed model in memory after its last request
+KEEP_ALIVE = "30m"
+SERVER_START_TIMEOUT = 15
+
+
+def get_ollama_host():
+    # OLLAMA_HOST as Ollama itself accepts it ('0.0.0.0', 'host:port' or a full url),
+    # the manager and the inference clients both use it so they talk to one server
+    host = (os.getenv("OLLAMA_HOST") or OLLAMA_HOST).strip().rstrip("/")
+    if "://" in host:
+        return host
+    host = f"http://{host}"
+    if urlsplit(host).port is None:
+        host = f"{host}:{OLLAMA_PORT}"
+    return host
+
+
+def get_model_names(models):
+    # 'llama3.2' is installed as 'llama3.2:latest', both names are accepted
+    names = set()
+    for model in models:
+        name = model.get("model") or model.get("name")
+        if name:
+            names.add(name)
+            if name.endswith(":latest"):
+                names.add(name[: -len(":latest")])
+    return names
+
+
+class OllamaManager:
+    # One per process: the server is started (or found running) once, the installed
+    # models are cached, and models are pulled and loaded in the background
+    def __init__(self, host=OLLAMA_HOST, models_ttl=MODELS_TTL, keep_alive=KEEP_ALIVE):
+        self.host = host
+        # OpenAI compatible endpoint of the same server, used for the inference
+        self.base_url = f"{host}/v1"
+        self.models_ttl = models_ttl
+        self.keep_alive = keep_alive
+        self.client = ollama.Client(host=host)
+        self._server_lock = threading.Lock()
+        self._server_ready = False
+        self._server_process = None
+        self._models_lock = threading.Lock()
+        self._models = None
+        self._models_time = 0.0
+        self._pull_locks = dict()
+        self._ready = dict()
+        self._warming = set()
+
+    def is_server_running(self):
+        try:
+            self.client.ps()
+            return True
+        except Exception:
+            return False
+
+    def ensure_server(self):
+        with self._server_lock:
+            if self._server_ready:
+                return True
+            if self.is_server_running():
+                self._server_ready = True
+                return True
+            # Spawned once per process (again only if it exited), a server that is
+            # already running is reused as is
+            if self._server_process is None or self._server_process.poll() is not None:
+                print("Starting the Ollama server")
+                try:
+                    self._server_process = subprocess.Popen(
+                        ["ollama", "serve"],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                        env={**os.environ, "OLLAMA_KEEP_ALIVE": self.keep_alive},
+                    )
+                except FileNotFoundError:
+                    print(
+                        "Ollama is not installed, see https://ollama.com/download, "
+                        f"or run it yourself and check {self.host}"
+                    )
+                    return False
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while time.monotonic() < deadline:
+                if self.is_server_running():
+                    self._server_ready = True
+                    return True
+                time.sleep(0.25)
+            print(f"Ollama is not answering at {self.host}")
+            return False
+
+    def list_models(self, refresh=False):
+        with self._models_lock:
+            expired = time.monotonic() - self._models_time > self.models_ttl
+            if self._models is None or refresh or expired:
+                self._models = get_model_names(self.client.list().get("models", []))
+                self._models_time = time.monotonic()
+            return self._models
+
+    def invalidate(self):
+        with self._models_lock:
+            self._models = None
+
+    def has_model(self, model_name, refresh=False):
+        return model_name in self.list_models(refresh)
+
+    def ensure_model(self, model_name):
+        # Served from the cached model list, Ollama is only asked again after the TTL
+        # or before pulling
+        if self._server_ready:
+            try:
+                if self.has_model(model_name):
+                    return
+            except ConnectionError:
+                # The server went away, it is looked for (or started) again below
+                self._server_ready = False
+        if not self.ensure_server():
+            raise ConnectionError(f"Ollama is not running at {self.host}")
+        with self._models_lock:
+            pull_lock = self._pull_locks.setdefault(model_name, threading.Lock())
+        # Concurrent requests for a missing model wait for a single pull
+        with pull_lock:
+            if self.has_model(model_name, refresh=True):
+                return
+            print(
+                f"{model_name} not exists locally, start pulling it from ollama library..."
+            )
+            self.client.pull(model_name)
+            self.invalidate()
+            print(f"{model_name} pulled")
+
+    def warm_up(self, model_name):
+        # An empty prompt loads the model in memory, the first request then skips it
+        try:
+            self.ensure_model(model_name)
+            self.client.generate(
+                model=model_name, prompt="", keep_alive=self.keep_alive
+            )
+        except Exception as e:
+            print(f"Could not warm up {model_name}: {e}")
+            return False
+        finally:
+            with self._models_lock:
+                self._warming.discard(model_name)
+        self.get_ready_event(model_name).set()
+        print(f"{model_name} is ready")
+        return True
+
+    def warm_up_in_background(self, model_names):
+        # Models are pulled one after the other, they share the bandwidth anyway
+        # Models already loaded, or being loaded for another instance, are skipped
+        with self._models_lock:
+            model_names = [
+                name
+                for name in dict.fromkeys(model_names)
+                if name not in self._warming
+                and not self._ready.get(name, threading.Event()).is_set()
+            ]
+            self._warming.update(model_names)
+        if not model_names:
+            return None
+        thread = threading.Thread(
+            target=lambda: [self.warm_up(name) for name in model_names], daemon=True
+        )
+        thread.start()
+        return thread
+
+    def get_ready_event(self, model_name):
+        with self._models_lock:
+            return self._ready.setdefault(model_name, threading.Event())
+
+    def is_ready(self, model_name):
+        return self.get_ready_event(model_name).is_set()
+
+    def wait_until_ready(self, model_name, timeout=None):
+        return self.get_ready_event(model_name).wait(timeout)
+
+    def get_status(self):
+        with self._models_lock:
+            ready = {name: event.is_set() for name, event in self._ready.items()}
+        return {"server": self._server_ready, "models": ready}
+
+
+_ollama_manager = None
+_ollama_manager_lock = threading.Lock()
+
+
+def get_ollama_manager():
+    global _ollama_manager
+    with _ollama_manager_lock:
+        if _ollama_manager is None:
+            _ollama_manager = OllamaManager(
+                host=get_ollama_host(),
+                keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", KEEP_ALIVE),
+            )
+    return _ollama_manager
@@ -0,0 +1,55 @@
+import re
+import sys
+import threading
+
+# Indentation and line continuations of the triple-quoted prompts in the code
+WHITESPACE_RE = re.compile(r"\t+| {2,}")
+
+
+def static_prompt(text):
+    # Compacted once at import and interned: every request starts with the very same
+    # string, which is what provider-side prompt caching and Ollama's KV cache reuse
+    # need to skip the prefix
+    return sys.intern(WHITESPACE_RE.sub(" ", text))
+
+
+def render_prompt(template, **values):
+    # Static instructions come first in the templates, the variable values (CV, page
+    # content, question...) are only inserted at the end and keep their formatting
+    return template.format(**values)
+
+
+class UsageTracker:
+    # Prompt tokens sent and served from the provider prompt cache, per model
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = dict()
+
+    def record(self, model_name, usage):
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        with self._lock:
+            totals = self._usage.setdefault(
+                model_name, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            )
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+        if prompt_tokens:
+            print(
+                f"Prompt tokens for {model_name}: {prompt_tokens}, "
+                f"{cached_tokens} from the prompt cache "
+                f"({cached_tokens / prompt_tokens:.0%})"
+            )
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                model_name: dict(totals) for model_name, totals in self._usage.items()
+            }
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+from collections import deque
+
+from dotenv import load_dotenv
+
+from base.ollama_manager import get_ollama_manager
+from base.tokens import count_message_tokens
+
+# Model name letting the router pick the model as well as the backend
+AUTO_MODEL = "auto"
+POLICIES = ("cheapest", "fastest", "local-first")
+# Backends failing this often over their window are only tried after the others, until
+# they have not failed for the cooldown, in seconds
+MAX_ERROR_RATE = 0.5
+UNHEALTHY_COOLDOWN = 30
+
+
+class Backend:
+    # An OpenAI compatible endpoint and the models it serves, the first one being its
+    # default model, with its rolling latency and error rate
+    def __init__(
+        self,
+        name,
+        models,
+        base_url=None,
+        api_key=None,
+        cost=0.0,
+        local=False,
+        timeout=60.0,
+        max_prompt_tokens=None,
+        window=20,
+    ):
+        self.name = name
+        self.models = list(models)
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cost = cost
+        self.local = local
+        self.timeout = timeout
+        self.max_prompt_tokens = max_prompt_tokens
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+        self.last_error_time = None
+
+    def get_avg_latency(self):
+        # Backends without a successful request yet are assumed fast, so they get tried
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    def get_error_rate(self):
+        if not self.errors:
+            return 0.0
+        return sum(self.errors) / len(self.errors)
+
+    def is_unhealthy(self):
+        return (
+            self.get_error_rate() > MAX_ERROR_RATE
+            and time.monotonic() - self.last_error_time < UNHEALTHY_COOLDOWN
+        )
+
+
+class ModelRouter:
+    def __init__(self, policy="local-first", window=20):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy {policy}, use one of {POLICIES}")
+        self.policy = policy
+        self.window = window
+        self.backends = dict()
+        self._lock = threading.Lock()
+
+    def register(self, name, models, **kwargs):
+        with self._lock:
+            self.backends[name] = Backend(name, models, window=self.window, **kwargs)
+        return self.backends[name]
+
+    def list_models(self):
+        return [model for backend in self.backends.values() for model in backend.models]
+
+    def get_backend(self, model_name):
+        for backend in self.backends.values():
+            if model_name in backend.models:
+                return backend
+        return None
+
+    def route(self, message, model_name=AUTO_MODEL):
+        # (backend, model) pairs in the order they should be tried: the requested model
+        # first if any, then the default model of every other backend as fallbacks
+        if not self.backends:
+            raise ValueError("No backend registered in the model router")
+        requested = None
+        if model_name != AUTO_MODEL:
+            requested = self.get_backend(model_name)
+            if requested is None:
+                raise ValueError(
+                    f"{model_name} is not served by any registered backend"
+                )
+
+        prompt_tokens = count_message_tokens(message) if message else 0
+        with self._lock:
+            fallbacks = sorted(
+                (b for b in self.backends.values() if b is not requested and b.models),
+                key=lambda backend: self.get_sort_key(backend, prompt_tokens),
+            )
+        routes = [(backend, backend.models[0]) for backend in fallbacks]
+        if requested is not None:
+            routes.insert(0, (requested, model_name))
+        return routes
+
+    def get_sort_key(self, backend, prompt_tokens):
+        unhealthy = backend.is_unhealthy()
+        # Prompts too long for a backend (small local models) go to the others first
+        too_long = (
+            backend.max_prompt_tokens is not None
+            and prompt_tokens > backend.max_prompt_tokens
+        )
+        if self.policy == "cheapest":
+            key = (backend.cost, backend.get_avg_latency())
+        elif self.policy == "fastest":
+            key = (backend.get_avg_latency(), backend.cost)
+        else:
+            key = (not backend.local, backend.cost, backend.get_avg_latency())
+        return (unhealthy, too_long) + key
+
+    def record(self, backend, latency=None, error=False):
+        with self._lock:
+            backend.errors.append(error)
+            if error:
+                backend.last_error_time = time.monotonic()
+            if latency is not None:
+                backend.latencies.append(latency)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "models": list(backend.models),
+                    "requests": len(backend.errors),
+                    "avg_latency": round(backend.get_avg_latency(), 3),
+                    "error_rate": round(backend.get_error_rate(), 3),
+                }
+                for name, backend in self.backends.items()
+            }
+
+
+def get_env_list(name, default):
+    return [
+        item.strip() for item in os.getenv(name, default).split(",") if item.strip()
+    ]
+
+
+def build_default_router(policy=None):
+    # Backends and policy come from the environment (or .env), so the routing can be
+    # changed without touching the tools
+    load_dotenv()
+    router = ModelRouter(policy or os.getenv("LLM_ROUTING_POLICY", "local-first"))
+    timeout = float(os.getenv("LLM_TIMEOUT", "60"))
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key and api_key.startswith("sk-proj"):
+        router.register(
+            "openai",
+            get_env_list("OPENAI_MODELS", "gpt-4o-mini"),
+            # Relative price per token, only compared between backends
+            cost=float(os.getenv("OPENAI_COST", "1.0")),
+            timeout=timeout,
+        )
+    router.register(
+        "ollama",
+        get_env_list("OLLAMA_MODELS", "llama3.2,deepseek-r1:1.5b"),
+        base_url=get_ollama_manager().base_url,
+        api_key="ollama",
+        local=True,
+        timeout=timeout,
+        max_prompt_tokens=int(os.getenv("OLLAMA_MAX_PROMPT_TOKENS", "2000")),
+    )
+    return router
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def get_default_router():
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = build_default_router()
+    return _default_router
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from base.embeddings import DEFAULT_EMBEDDING_MODEL, embed_texts
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Cosine similarity above which two questions are considered the same
+DEFAULT_THRESHOLD = 0.92
+
+
+class _VectorIndex:
+    # Inner product search over unit vectors with removable ids, faiss when available
+    # and a brute force NumPy search otherwise
+    def __init__(self, dim):
+        self.dim = dim
+        if faiss is not None:
+            self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        else:
+            self.index = None
+            self.vectors = dict()
+
+    def add(self, entry_id, vector):
+        if self.index is not None:
+            self.index.add_with_ids(
+                vector.reshape(1, -1), np.array([entry_id], dtype=np.int64)
+            )
+        else:
+            self.vectors[entry_id] = vector
+
+    def remove(self, entry_ids):
+        # Several ids at once, removing from a flat faiss index rewrites it every call
+        if self.index is not None:
+            self.index.remove_ids(np.array(list(entry_ids), dtype=np.int64))
+        else:
+            for entry_id in entry_ids:
+                self.vectors.pop(entry_id, None)
+
+    def search(self, vector):
+        # (id, similarity) of the nearest entry, or (None, -1.0) if the index is empty
+        if self.index is not None:
+            if self.index.ntotal == 0:
+                return None, -1.0
+            similarities, ids = self.index.search(vector.reshape(1, -1), 1)
+            return int(ids[0, 0]), float(similarities[0, 0])
+        if not self.vectors:
+            return None, -1.0
+        ids = list(self.vectors)
+        similarities = np.stack([self.vectors[i] for i in ids]) @ vector
+        best = int(np.argmax(similarities))
+        return ids[best], float(similarities[best])
+
+
+class SemanticCache:
+    # Answers of previous questions, looked up by meaning instead of exact text. Every
+    # namespace (one per model and prompt) has its own index, the least recently used
+    # entries are evicted first
+    def __init__(
+        self,
+        threshold=DEFAULT_THRESHOLD,
+        max_entries=10_000,
+        ttl=None,
+        embedding_model=DEFAULT_EMBEDDING_MODEL,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedding_model = embedding_model
+        self._namespaces = dict()
+        # entry id -> (namespace, question, answer, created_at), in LRU order
+        self._entries = OrderedDict()
+        # entry id -> created_at, oldest first, so expired entries are found without
+        # scanning the whole cache
+        self._created = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lookup_seconds = 0.0
+
+    def get(self, namespace, question):
+        start = time.perf_counter()
+        vector = embed_texts([question], self.embedding_model)[0]
+        with self._lock:
+            answer = self._search(namespace, vector)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._lookup_seconds += time.perf_counter() - start
+        return answer
+
+    def set(self, namespace, question, answer):
+        vector = embed_texts([question], self.embedding_model)[0]
+        with self._lock:
+            index = self._namespaces.get(namespace)
+            if index is None:
+                index = self._namespaces[namespace] = _VectorIndex(len(vector))
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add(entry_id, vector)
+            created_at = time.time()
+            self._entries[entry_id] = (namespace, question, answer, created_at)
+            self._created[entry_id] = created_at
+            # Expired entries go first, they would otherwise stay in the index until
+            # they happen to be the nearest neighbour of a question
+            self._remove_expired()
+            while len(self._entries) > self.max_entries:
+                self._remove([next(iter(self._entries))])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+            self._entries.clear()
+            self._created.clear()
+
+    def metrics(self):
+        with self._lock:
+            n_lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / n_lookups if n_lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "avg_lookup_ms": (
+                    self._lookup_seconds / n_lookups * 1000 if n_lookups else 0.0
+                ),
+            }
+
+    def _search(self, namespace, vector):
+        index = self._namespaces.get(namespace)
+        if index is None:
+            return None
+        entry_id, similarity = index.search(vector)
+        if entry_id is None or similarity < self.threshold:
+            return None
+        _, _, answer, created_at = self._entries[entry_id]
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            self._remove_expired()
+            return None
+        self._entries.move_to_end(entry_id)
+        return answer
+
+    def _remove_expired(self):
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        expired_ids = []
+        for entry_id, created_at in self._created.items():
+            if created_at > deadline:
+                break
+            expired_ids.append(entry_id)
+        self._remove(expired_ids)
+        self.expirations += len(expired_ids)
+
+    def _remove(self, entry_ids):
+        ids_by_namespace = dict()
+        for entry_id in entry_ids:
+            namespace = self._entries.pop(entry_id)[0]
+            self._created.pop(entry_id)
+            ids_by_namespace.setdefault(namespace, []).append(entry_id)
+        for namespace, namespace_ids in ids_by_namespace.items():
+            self._namespaces[namespace].remove(namespace_ids)
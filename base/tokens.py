@@ -0,0 +1,76 @@
+import functools
+import math
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Rough average for English text, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = "o200k_base"
+# Overhead of the chat format, see the OpenAI cookbook on counting tokens
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name=None):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except (KeyError, ValueError, TypeError):
+        pass
+    # Local models (llama3.2, deepseek, ...) are approximated with the GPT tokenizer
+    try:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        print(f"Tokenizer unavailable, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text, model_name=None):
+    if not text:
+        return 0
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model_name=None):
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def split_to_tokens(text, max_tokens, model_name=None):
+    # Consecutive pieces of at most max_tokens tokens covering the whole text
+    max_tokens = max(max_tokens, 1)
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        step = max_tokens * CHARS_PER_TOKEN
+        return [text[i : i + step] for i in range(0, len(text), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[i : i + max_tokens])
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+def count_message_tokens(messages, model_name=None):
+    # Chat formatting adds a few tokens around every message and before the answer
+    return (
+        sum(
+            count_tokens(message["content"], model_name) + TOKENS_PER_MESSAGE
+            for message in messages
+        )
+        + TOKENS_PER_REPLY
+    )
@@ -1,28 +1,149 @@
 import json
 import time
-import markdown2
+import queue
+import threading
 
+# Deltas smaller than this are held back and merged with the next ones
+MIN_CHUNK_CHARS = 32
+# ... but never for longer than this, in seconds
+MAX_CHUNK_DELAY = 0.05
+# SSE comment sent when the model is silent for this long, keeps proxies from closing
+# the connection, in seconds
+HEARTBEAT_INTERVAL = 15.0
 
-def get_stream(stream_from_api):
-    text = ""
+_END_OF_STREAM = object()
+
+
+def iter_text(stream_from_api):
+    # Text deltas of an OpenAI stream, a list of strings or a whole string
+    if isinstance(stream_from_api, str):
+        if stream_from_api:
+            yield stream_from_api
+        return
     for chunk in stream_from_api:
         if isinstance(chunk, str):
-            time.sleep(0.02)
-            text += chunk
+            text = chunk
+        elif chunk.choices:
+            text = chunk.choices[0].delta.content
         else:
-            time.sleep(0.05)
-            text += chunk.choices[0].delta.content or ""
-            # text.replace('```','').replace('markdown', '')
-        # text_html = markdown2.markdown(text)
-        yield f"data: {json.dumps({'content': text})}\n\n"  # SSE format
+            # Usage chunk at the end of the stream
+            continue
+        if text:
+            yield text
+
+
+def _read_in_background(texts, stop_event):
+    # The model stream is read by a thread so that the SSE generator can send
+    # heartbeats and flush held-back deltas while waiting for the next chunk
+    chunk_queue = queue.Queue()
+
+    def producer():
+        try:
+            for text in texts:
+                if stop_event.is_set():
+                    break
+                chunk_queue.put(text)
+        except Exception as e:
+            chunk_queue.put(e)
+        finally:
+            chunk_queue.put(_END_OF_STREAM)
+
+    threading.Thread(target=producer, daemon=True).start()
+    return chunk_queue
+
 
+def coalesce_chunks(
+    stream_from_api,
+    min_chunk_chars=MIN_CHUNK_CHARS,
+    max_chunk_delay=MAX_CHUNK_DELAY,
+    heartbeat_interval=None,
+):
+    # Yields merged text deltas, and None as heartbeat when nothing came for
+    # heartbeat_interval seconds
+    stop_event = threading.Event()
+    chunk_queue = _read_in_background(iter_text(stream_from_api), stop_event)
+    buffer = []
+    buffered_chars = 0
+    flush_deadline = None
+    last_event = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            timeouts = []
+            if flush_deadline is not None:
+                timeouts.append(flush_deadline - now)
+            if heartbeat_interval:
+                timeouts.append(last_event + heartbeat_interval - now)
+            try:
+                item = chunk_queue.get(
+                    timeout=max(min(timeouts), 0) if timeouts else None
+                )
+            except queue.Empty:
+                item = None
 
-def get_stream_v2(stream_from_api):
+            if isinstance(item, Exception):
+                raise item
+            if item is _END_OF_STREAM:
+                if buffer:
+                    yield "".join(buffer)
+                return
+            if item is not None:
+                if not buffer:
+                    flush_deadline = time.monotonic() + max_chunk_delay
+                buffer.append(item)
+                buffered_chars += len(item)
+
+            now = time.monotonic()
+            if buffer and (buffered_chars >= min_chunk_chars or now >= flush_deadline):
+                yield "".join(buffer)
+                buffer, buffered_chars, flush_deadline = [], 0, None
+                last_event = now
+            elif (
+                heartbeat_interval
+                and not buffer
+                and now >= last_event + heartbeat_interval
+            ):
+                yield None
+                last_event = now
+    finally:
+        # Stops reading the model stream when the client went away
+        stop_event.set()
+
+
+def get_stream(
+    stream_from_api,
+    pacing=0.0,
+    min_chunk_chars=MIN_CHUNK_CHARS,
+    max_chunk_delay=MAX_CHUNK_DELAY,
+    heartbeat_interval=HEARTBEAT_INTERVAL,
+):
+    # SSE events only carry the new text: {"delta": ..., "seq": n}. The client appends
+    # the deltas in seq order, the final "done" event gives the total length to check
+    # the reassembled text against
+    seq = 0
+    length = 0
+    for delta in coalesce_chunks(
+        stream_from_api, min_chunk_chars, max_chunk_delay, heartbeat_interval
+    ):
+        if delta is None:
+            yield ": heartbeat\n\n"
+            continue
+        yield f"data: {json.dumps({'delta': delta, 'seq': seq})}\n\n"  # SSE format
+        seq += 1
+        # Counted in UTF-16 code units like a JavaScript string length
+        length += len(delta.encode("utf-16-le")) // 2
+        if pacing:
+            time.sleep(pacing)
+    yield f"event: done\ndata: {json.dumps({'seq': seq, 'length': length})}\n\n"
+
+
+def get_stream_v2(
+    stream_from_api, min_chunk_chars=MIN_CHUNK_CHARS, max_chunk_delay=MAX_CHUNK_DELAY
+):
+    # Gradio replaces the output with every value, so the whole text is yielded, but
+    # only once enough new text came in
     text = ""
-    for chunk in stream_from_api:
-        if isinstance(chunk, str):
-            text += chunk
-        else:
-            text += chunk.choices[0].delta.content or ""
+    for delta in coalesce_chunks(stream_from_api, min_chunk_chars, max_chunk_delay):
+        text += delta
         yield text
     return text